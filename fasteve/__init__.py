@@ -1,6 +1,6 @@
 from .applications import Fasteve
 from .model import MongoModel, SQLModel
-from .resource import Resource, SubResource
+from .resource import Index, Resource, SubResource
 from .core.utils import MongoObjectId
 from .utils import MongoField
 from fastapi import Response
@@ -1,13 +1,16 @@
 from fastapi import FastAPI, APIRouter
+from fastapi.responses import StreamingResponse
 from .middleware.resource import ResourceMiddleware
 from .middleware.cors import CORSMiddleware
 from .endpoints import (
     collections_endpoint_factory,
+    export_endpoint_factory,
+    import_endpoint_factory,
     home_endpoint,
     item_endpoint_factory,
     subresource_endpoint_factory,
 )
-from .events import Events
+from .events import Events, EventQueue
 from .model import (
     BaseResponseModel,
     ItemBaseResponseModel,
@@ -20,10 +23,9 @@ from types import ModuleType
 from .resource import Resource
 from .io.mongo import MongoDataLayer
 from .io.sql import SQLDataLayer
-from .core.utils import log, MongoObjectId, is_new_type, repeat_every as repeat
+from .core.utils import log, MongoObjectId, repeat_every as repeat
 from datetime import datetime
 from pydantic import Field, create_model
-import asyncio
 import logging
 
 
@@ -59,20 +61,41 @@ class Fasteve(FastAPI):
 
         self.data = data(app=self)  # eve pattern
 
-        if type(self.data) == Type[MongoDataLayer]:
-            # TODO: move to datalayer
-            for resource in self.resources:
-                self.create_mongo_index(resource)
-
         for resource in self.resources:
             self.register_resource(resource)
 
-        self.events = Events(resources)
+        self.events = Events(
+            resources,
+            concurrent_after=self.config.EVENTS_CONCURRENT_AFTER,
+            queue=EventQueue(
+                maxsize=self.config.EVENTS_QUEUE_SIZE,
+                workers=self.config.EVENTS_QUEUE_WORKERS,
+                overflow=self.config.EVENTS_QUEUE_OVERFLOW,
+                drain_timeout=self.config.EVENTS_QUEUE_DRAIN_TIMEOUT,
+            ),
+        )
         setattr(self.router, "add_event_handler", self.add_event_handler)
+        self.add_event_handler("startup", self.events.compile)
+        self.add_event_handler("startup", self.events.queue.start)
         self.add_event_handler("startup", self.data.connect)
+        # deferred callbacks may still use the database
+        self.add_event_handler("shutdown", self.events.queue.stop)
         self.add_event_handler("shutdown", self.data.close)
 
-    def add_event_handler(self, event_type: str, func: Callable) -> None:
+    def on_event(self, event_type: str, deferred: bool = False) -> Callable:  # type: ignore
+        """Register a startup/shutdown handler or an event hook. Deferred
+        hooks run in the background after the response is sent.
+        """
+
+        def decorator(func: Callable) -> Callable:
+            self.add_event_handler(event_type, func, deferred=deferred)
+            return func
+
+        return decorator
+
+    def add_event_handler(
+        self, event_type: str, func: Callable, deferred: bool = False
+    ) -> None:
         if event_type == "startup":
             self.router.on_startup.append(func)
         elif event_type == "shutdown":
@@ -80,7 +103,7 @@ class Fasteve(FastAPI):
         else:
             # Event Hooks
             try:
-                getattr(self.events, event_type).append(func)
+                self.events.register(event_type, func, deferred=deferred)
             except Exception as e:
                 raise e
 
@@ -104,10 +127,11 @@ class Fasteve(FastAPI):
             resource.response_model, resource.name
         )
         resource.response_model = response_model
+        read_model = self._read_model(resource)
 
         Response = create_model(
             f"ResponseModel_{resource.name}",
-            data=(List[response_model], Field(..., alias=self.config.DATA)),  # type: ignore
+            data=(List[read_model], Field(..., alias=self.config.DATA)),  # type: ignore
             __base__=BaseResponseModel,
         )
 
@@ -143,9 +167,24 @@ class Fasteve(FastAPI):
                     methods=[method],
                 )
 
+        if resource.export:
+            # before the item routes so _export is not taken for an item id
+            router.add_api_route(
+                f"/{resource.name}/_export",
+                endpoint=export_endpoint_factory(resource),
+                methods=["GET"],
+                response_class=StreamingResponse,
+            )
+        if resource.bulk_import:
+            router.add_api_route(
+                f"/{resource.name}/_import",
+                endpoint=import_endpoint_factory(resource),
+                methods=["POST"],
+            )
+
         ItemResponse = create_model(
             f"ItemResponseModel_{resource.name}",
-            data=(List[response_model], Field(..., alias=self.config.DATA)),  # type: ignore
+            data=(List[read_model], Field(..., alias=self.config.DATA)),  # type: ignore
             __base__=ItemBaseResponseModel,
         )
 
@@ -169,7 +208,7 @@ class Fasteve(FastAPI):
         for sub_resource in resource.sub_resources:
             Response = create_model(
                 f"ResponseModel_{resource.name}_sub_resource_{sub_resource.name}",
-                data=(List[sub_resource.resource.response_model], Field(..., alias=self.config.DATA)),  # type: ignore
+                data=(List[self._read_model(sub_resource.resource)], Field(..., alias=self.config.DATA)),  # type: ignore
                 __base__=BaseResponseModel,
             )
 
@@ -188,25 +227,6 @@ class Fasteve(FastAPI):
             tags=[str(resource.name)],
         )
 
-    async def _create_mongo_index_internal(
-        self, resource: Resource, field_name: str
-    ) -> None:
-        collection = await self.data.get_collection(resource=resource)  # type: ignore
-        # TODO: index should be removed at some point...
-        # or at least check to see if there is one already
-        res = await collection.create_index(field_name, unique=True)  # type: ignore # TODO: move to data layer
-        print(f"Created unique index for {field_name} in {resource.name}")
-
-    def create_mongo_index(self, resource: Resource) -> None:
-        fields = resource.model.__fields__
-        for name in fields:
-            field = fields[name]
-            type_ = field.type_
-            if not is_new_type(type_):
-                continue
-            if type_.__name__ == "Unique":
-                asyncio.create_task(self._create_mongo_index_internal(resource, name))
-
     def repeat_every(
         self,
         *,
@@ -236,17 +256,36 @@ class Fasteve(FastAPI):
     ) -> Union[MongoModel, SQLModel]:
 
         fields = model.__fields__.keys()
-        for name in fields:
+        relations = [
+            name
+            for name in fields
+            if "data_relation" in model.__fields__[name].field_info.extra
+        ]
+        if response and relations and getattr(model.__config__, "table", False):
+            # sql table models can not be extended, use a pydantic copy
+            model = create_model(  # type: ignore
+                model.__name__,  # type: ignore
+                __base__=BaseModel,
+                **{
+                    name: (
+                        field.outer_type_
+                        if field.required
+                        else Optional[field.outer_type_],
+                        field.field_info,
+                    )
+                    for name, field in model.__fields__.items()
+                },
+            )
+        for name in relations:
             field = model.__fields__[name]
 
-            if not "data_relation" in field.field_info.extra:
-                continue
-
             data_relation = field.field_info.extra["data_relation"]
             outer_type_ = field.outer_type_
             many = False
 
-            if outer_type_ not in (MongoObjectId, List[MongoObjectId]):
+            # ids are ObjectIds or (sql) int/str primary keys
+            id_types = (MongoObjectId, int, str)
+            if outer_type_ not in id_types + tuple(List[t] for t in id_types):  # type: ignore
                 raise ValueError(
                     f"Data relation ({model.__name__}: {name}) must be must be type MongoObjectId or List[MongoObjectId]"  # type: ignore
                 )
@@ -255,11 +294,13 @@ class Fasteve(FastAPI):
                 response_model = self._prepare_response_model(
                     data_relation.response_model, data_relation.name + "_embedded"
                 )  # add ids, create, updated, ect
-                if outer_type_ == MongoObjectId:
-                    type_ = Union[Type[outer_type_], Type[response_model]]  # type: ignore # meta typing
+                if outer_type_ in id_types:
+                    type_ = Union[outer_type_, response_model]  # type: ignore # meta typing
                 else:
-                    type_ = Union[Type[outer_type_], List[Type[response_model]]]  # type: ignore # meta typing
+                    type_ = Union[outer_type_, List[response_model]]  # type: ignore # meta typing
                     many = True
+            elif getattr(model.__config__, "table", False):
+                continue  # keep the sql table model, it already has data_relation
             else:
                 type_ = outer_type_  # type: ignore # meta typing
 
@@ -290,6 +331,23 @@ class Fasteve(FastAPI):
             __base__=response_model,
         )
 
+    def _read_model(self, resource: Resource) -> Union[MongoModel, SQLModel]:
+        """Response model of GET requests. With projection every field is
+        optional so projected (partial) documents are valid.
+        """
+        if not resource.projection:
+            return resource.response_model
+        fields = resource.response_model.__fields__
+        partial_fields = {
+            name: (Optional[field.outer_type_], Field(None, alias=field.alias))
+            for name, field in fields.items()
+        }
+        return create_model(  # type: ignore
+            f"Partial{resource.response_model.__name__}",  # type: ignore
+            __base__=BaseModel,
+            **partial_fields,
+        )
+
     def _register_home_endpoint(self) -> None:
         self.add_api_route(f"/", home_endpoint, methods=["GET"])
 
@@ -0,0 +1,69 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+import json
+import time
+
+
+def cache_key(value: Any) -> str:
+    """Stable key for a query dict"""
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+class TTLCache:
+    """Small in process cache. Entries expire ttl seconds after they are set
+    and the least recently used entry is evicted once maxsize is reached.
+
+    generation changes on every clear, so a value read from the database
+    before a write (which clears the cache) is not cached after it.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # dropped to stay within maxsize
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        try:
+            expires, value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        if expires < time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        if generation is not None and generation != self.generation:
+            return  # cleared since the value was read
+        self._data.pop(key, None)
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.generation += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -16,8 +16,54 @@ MONGODB_URI = config(
     "FASTEVE_MONGODB_URI", cast=str, default="mongodb://localhost:27017"
 )
 MONGODB_NAME = config("FASTEVE_MONGODB_NAME", cast=str, default="fasteve_database")
+MONGODB_ALLOW_DISK_USE = config(
+    "FASTEVE_MONGODB_ALLOW_DISK_USE", cast=bool, default=True
+)  # let aggregations ($sort, $group) spill to disk
 SQL_URI = config("FASTEVE_SQL_URI", cast=str, default="sqlite://")
 SQL_ECHO = config("FASTEVE_SQL_ECHO", cast=bool, default=False)
+SQL_MODE = config(
+    "FASTEVE_SQL_MODE", cast=str, default="sync"
+)  # sync, async or threadpool
+SQL_THREADPOOL_SIZE = config(
+    "FASTEVE_SQL_THREADPOOL_SIZE", cast=int, default=0
+)  # 0 matches the engine pool size
+SQL_BULK_CHUNK_SIZE = config(
+    "FASTEVE_SQL_BULK_CHUNK_SIZE", cast=int, default=1000
+)  # rows per INSERT statement
+INDEX_MODE = config(
+    "FASTEVE_INDEX_MODE", cast=str, default="create"
+)  # create, dry-run or off
+WHERE_CACHE_SIZE = config(
+    "FASTEVE_WHERE_CACHE_SIZE", cast=int, default=1024
+)  # parsed where filters kept in memory
+WHERE_MAX_DEPTH = config(
+    "FASTEVE_WHERE_MAX_DEPTH", cast=int, default=32
+)  # nested $and/$or allowed in a where filter
+ALT_ID_CACHE_TTL = config(
+    "FASTEVE_ALT_ID_CACHE_TTL", cast=float, default=60
+)  # seconds an alt_id -> id lookup is cached (cleared by writes)
+MAX_RESULTS_CAP = config(
+    "FASTEVE_MAX_RESULTS_CAP", cast=int, default=1000
+)  # max items per page
+EXPORT_BATCH_SIZE = config(
+    "FASTEVE_EXPORT_BATCH_SIZE", cast=int, default=1000
+)  # items fetched at a time by /{resource}/_export
+IMPORT_BATCH_SIZE = config(
+    "FASTEVE_IMPORT_BATCH_SIZE", cast=int, default=1000
+)  # items inserted at a time by /{resource}/_import
+EVENTS_CONCURRENT_AFTER = config(
+    "FASTEVE_EVENTS_CONCURRENT_AFTER", cast=bool, default=False
+)  # run the after_* callbacks of an event with asyncio.gather
+EVENTS_QUEUE_SIZE = config(
+    "FASTEVE_EVENTS_QUEUE_SIZE", cast=int, default=1000
+)  # deferred callbacks waiting to run
+EVENTS_QUEUE_WORKERS = config("FASTEVE_EVENTS_QUEUE_WORKERS", cast=int, default=1)
+EVENTS_QUEUE_OVERFLOW = config(
+    "FASTEVE_EVENTS_QUEUE_OVERFLOW", cast=str, default="drop"
+)  # drop or block when the queue is full
+EVENTS_QUEUE_DRAIN_TIMEOUT = config(
+    "FASTEVE_EVENTS_QUEUE_DRAIN_TIMEOUT", cast=float, default=10.0
+)  # seconds to wait for queued callbacks on shutdown
 CORS_ORIGINS = config("FASTEVE_CORS_ORIGINS", cast=str, default=None)
 CONNECTION_TIMEOUT = config("FASTEVE_CONNECTION_TIMEOUT", cast=int, default=10000)
 
@@ -26,6 +72,7 @@ QUERY_WHERE = config("FASTEVE_QUERY_WHERE", cast=str, default="where")
 QUERY_PROJECTION = config("FASTEVE_QUERY_PROJECTION", cast=str, default="projection")
 QUERY_SORT = config("FASTEVE_QUERY_SORT", cast=str, default="sort")
 QUERY_PAGE = config("FASTEVE_QUERY_PAGE", cast=str, default="page")
+QUERY_CURSOR = config("FASTEVE_QUERY_CURSOR", cast=str, default="cursor")
 QUERY_MAX_RESULTS = config("FASTEVE_QUERY_MAX_RESULTS", cast=str, default="max_results")
 QUERY_EMBEDDED = config("FASTEVE_QUERY_EMBEDDED", cast=str, default="embedded")
 QUERY_AGGREGATION = config("FASTEVE_QUERY_AGGREGATION", cast=str, default="aggregate")
@@ -0,0 +1,236 @@
+import ast
+import base64
+import copy
+import json
+from functools import lru_cache
+from typing import Any, List, Tuple
+
+from fasteve.core import config
+
+# operators allowed in a where filter
+LOGICAL_OPERATORS = ("$and", "$or")
+COMPARISON_OPERATORS = ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin")
+PYTHON_OPERATORS = {
+    ast.Eq: "$eq",
+    ast.NotEq: "$ne",
+    ast.Gt: "$gt",
+    ast.GtE: "$gte",
+    ast.Lt: "$lt",
+    ast.LtE: "$lte",
+    ast.In: "$in",
+    ast.NotIn: "$nin",
+}
+# value < field is field > value
+REVERSED_OPERATORS = {"$gt": "$lt", "$gte": "$lte", "$lt": "$gt", "$lte": "$gte"}
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def parse_where(where: str) -> dict:
+    """Parse a mongo style where filter e.g.
+    ?where={"name": "john", "age": {"$gte": 18}}
+    or the equivalent python style filter e.g.
+    ?where=name == "john" and age >= 18
+
+    Only the LOGICAL_OPERATORS and COMPARISON_OPERATORS are allowed so the
+    filter can be compiled by every data layer, nested at most
+    WHERE_MAX_DEPTH levels. Parsed filters are cached by the raw string
+    (WHERE_CACHE_SIZE).
+    """
+    return copy.deepcopy(cached_parse_where(where))
+
+
+@lru_cache(maxsize=config.WHERE_CACHE_SIZE)
+def cached_parse_where(where: str) -> dict:
+    if where.lstrip().startswith("{"):
+        try:
+            query = json.loads(where)
+        except (ValueError, RecursionError):
+            raise InvalidQuery("value is not a valid dict")
+    else:
+        query = parse_python_where(where)
+    validate_where(query)
+    return query
+
+
+def parse_python_where(where: str) -> dict:
+    try:
+        tree = ast.parse(where.strip(), mode="eval")
+    except (SyntaxError, ValueError, MemoryError, RecursionError):
+        raise InvalidQuery("value is not a valid query")
+    return python_filter(tree.body)  # type: ignore
+
+
+def python_filter(node: ast.expr, depth: int = 0) -> dict:
+    if depth > config.WHERE_MAX_DEPTH:
+        raise InvalidQuery("query is nested too deeply")
+    if isinstance(node, ast.BoolOp):
+        key = "$and" if isinstance(node.op, ast.And) else "$or"
+        return {key: [python_filter(value, depth + 1) for value in node.values]}
+    if isinstance(node, ast.Compare):
+        # a < b < c is a < b and b < c
+        clauses = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            clauses.append(python_comparison(left, op, right))
+            left = right
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+    raise InvalidQuery("expression is not allowed")
+
+
+def python_comparison(left: ast.expr, op: ast.cmpop, right: ast.expr) -> dict:
+    operator = PYTHON_OPERATORS.get(type(op))
+    if operator is None:
+        raise InvalidQuery(f"operator '{type(op).__name__}' is not allowed")
+    if is_python_field(left):
+        field, value = python_field(left), python_value(right)
+    elif is_python_field(right) and operator not in ("$in", "$nin"):
+        field, value = python_field(right), python_value(left)
+        operator = REVERSED_OPERATORS.get(operator, operator)
+    else:
+        raise InvalidQuery("comparisons must be between a field and a value")
+    if operator in ("$in", "$nin") and not isinstance(value, list):
+        raise InvalidQuery(f"'{operator}' must be a list")
+    return {field: value if operator == "$eq" else {operator: value}}
+
+
+def is_python_field(node: ast.expr) -> bool:
+    if isinstance(node, ast.Attribute):
+        return is_python_field(node.value)
+    return isinstance(node, ast.Name)
+
+
+def python_field(node: ast.expr) -> str:
+    """name -> "name", address.city -> "address.city" """
+    if isinstance(node, ast.Attribute):
+        return f"{python_field(node.value)}.{node.attr}"
+    return node.id  # type: ignore
+
+
+def python_value(node: ast.expr) -> Any:
+    try:
+        value = ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        # e.g. {[1]: 2} raises TypeError (unhashable key)
+        raise InvalidQuery("values must be literals")
+    if isinstance(value, (list, tuple)):
+        value = list(value)
+        items = value
+    else:
+        items = [value]
+    for item in items:
+        if item is not None and not isinstance(item, (str, int, float)):
+            raise InvalidQuery("values must be literals")
+    return value
+
+
+def validate_where(query: Any, depth: int = 0) -> None:
+    if depth > config.WHERE_MAX_DEPTH:
+        raise InvalidQuery("query is nested too deeply")
+    if not isinstance(query, dict):
+        raise InvalidQuery("value is not a valid dict")
+    for key, value in query.items():
+        if key in LOGICAL_OPERATORS:
+            if not isinstance(value, list) or not value:
+                raise InvalidQuery(f"'{key}' must be a non-empty list")
+            for sub_query in value:
+                validate_where(sub_query, depth + 1)
+        elif key.startswith("$"):
+            raise InvalidQuery(f"operator '{key}' is not allowed")
+        elif isinstance(value, dict):
+            for operator, operand in value.items():
+                if operator not in COMPARISON_OPERATORS:
+                    raise InvalidQuery(f"operator '{operator}' is not allowed")
+                if operator in ("$in", "$nin") and not isinstance(operand, list):
+                    raise InvalidQuery(f"'{operator}' must be a list")
+
+
+def query_fields(query: dict) -> List[str]:
+    """Fields used in a where filter (see parse_where)"""
+    fields = []
+    for key, value in query.items():
+        if key in LOGICAL_OPERATORS:
+            for sub_query in value:
+                fields += [f for f in query_fields(sub_query) if f not in fields]
+        elif key not in fields:
+            fields.append(key)
+    return fields
+
+
+def parse_projection(projection: str, primary_key: str = "_id") -> dict:
+    """Parse a mongo style projection e.g. ?projection={"name": 1}
+
+    Fields are either all included (1) or all excluded (0). The primary key
+    is returned unless it is excluded explicitly (which can be mixed with
+    included fields).
+    """
+    try:
+        fields = json.loads(projection)
+    except ValueError:
+        raise InvalidQuery("value is not a valid dict")
+    if not isinstance(fields, dict):
+        raise InvalidQuery("value is not a valid dict")
+    for field, value in fields.items():
+        if value not in (0, 1):
+            raise InvalidQuery(f"field '{field}' must be 0 or 1")
+    if len({value for field, value in fields.items() if field != primary_key}) > 1:
+        raise InvalidQuery("cannot mix included and excluded fields")
+    return {field: int(value) for field, value in fields.items()}
+
+
+def parse_sort(sort: str) -> List[Tuple[str, int]]:
+    """Parse a sort e.g. ?sort=-created,name into [("created", -1), ("name", 1)]"""
+    keys: List[Tuple[str, int]] = []
+    for field in sort.split(","):
+        field = field.strip()
+        direction = 1
+        if field.startswith("-"):
+            field, direction = field[1:].strip(), -1
+        if not field:
+            raise InvalidQuery("value is not a valid sort")
+        if field in [key for key, _ in keys]:
+            raise InvalidQuery(f"field '{field}' is repeated")
+        keys.append((field, direction))
+    return keys
+
+
+def keyset_filter(keys: List[Tuple[str, int]], values: List[Any]) -> dict:
+    """Filter for the items after values in keys order (keyset pagination) e.g.
+    keys [("a", 1), ("_id", 1)] -> {"$or": [{"a": {"$gt": a}},
+                                            {"a": a, "_id": {"$gt": _id}}]}
+
+    Nulls sort first ascending and last descending (as in mongo), so after
+    a null comes every non null value (ascending) and after a value come
+    the smaller values and the nulls (descending).
+    """
+    clauses = []
+    for i, (field, direction) in enumerate(keys):
+        clause: dict = {key: value for (key, _), value in zip(keys[:i], values[:i])}
+        value = values[i]
+        if direction > 0:
+            clause[field] = {"$ne": None} if value is None else {"$gt": value}
+        elif value is None:
+            continue  # nothing comes after the nulls
+        else:
+            clause["$or"] = [{field: {"$lt": value}}, {field: None}]
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """Opaque token holding the sort key(s) of the last item of a page"""
+    data = json.dumps(values, default=str, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except ValueError:
+        raise InvalidQuery("value is not a valid cursor")
+    if not isinstance(values, list):
+        raise InvalidQuery("value is not a valid cursor")
+    return values
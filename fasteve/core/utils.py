@@ -55,7 +55,8 @@ def is_new_type(type_: Type[Any]) -> bool:
     Check whether type_ was created using typing.NewType
     """
     # isinstance(type_, test_type.__class__) and hasattr(type_, "__supertype__")
-    return type_.__name__ == "Unique"
+    # typing constructs (Union, Any, ...) have no __name__ before python 3.10
+    return getattr(type_, "__name__", None) == "Unique"
 
 
 NoArgsNoReturnFuncT = Callable[[], None]
@@ -1,4 +1,9 @@
-from .collections import process_collections_request, collections_endpoint_factory
+from .collections import (
+    process_collections_request,
+    collections_endpoint_factory,
+    export_endpoint_factory,
+    import_endpoint_factory,
+)
 from .documents import process_item_request, item_endpoint_factory
 from .endpoints import (
     process_subresource_request,
@@ -1,7 +1,8 @@
 from starlette.requests import Request
-from fasteve.methods import delete, get, post
+from starlette.responses import StreamingResponse
+from fasteve.methods import delete, export, get, ingest, post
 from fastapi import HTTPException
-from typing import Callable, List, Union
+from typing import Callable, List, Optional, Union
 from fasteve.resource import Resource
 from fasteve.core.utils import log
 from pymongo.errors import DuplicateKeyError, BulkWriteError
@@ -32,7 +33,14 @@ def collections_endpoint_factory(resource: Resource, method: str) -> Callable:
         # no model validation on GET request
         # query prams
         async def get_endpoint(
-            request: Request, max_results: int = 25, page: int = 1, embedded: str = "{}"
+            request: Request,
+            max_results: int = 25,
+            page: int = 1,
+            embedded: str = "{}",
+            where: Optional[str] = None,
+            projection: Optional[str] = None,
+            sort: Optional[str] = None,
+            cursor: Optional[str] = None,
         ) -> dict:
             response = await process_collections_request(request)
             await request.app.events.run("after_read_resource", resource.name, response)
@@ -72,3 +80,26 @@ def collections_endpoint_factory(resource: Resource, method: str) -> Callable:
 
     else:
         raise Exception(f'"{method}" is an invalid HTTP method')
+
+
+def export_endpoint_factory(resource: Resource) -> Callable:
+    """Create the NDJSON export endpoint of a resource"""
+
+    async def export_endpoint(
+        request: Request,
+        where: Optional[str] = None,
+        projection: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> StreamingResponse:
+        return await export(request)
+
+    return export_endpoint
+
+
+def import_endpoint_factory(resource: Resource) -> Callable:
+    """Create the NDJSON import endpoint of a resource"""
+
+    async def import_endpoint(request: Request) -> dict:
+        return await ingest(request)
+
+    return import_endpoint
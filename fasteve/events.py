@@ -1,20 +1,140 @@
 from inspect import iscoroutinefunction
+from starlette.concurrency import run_in_threadpool
+from types import MappingProxyType
+from typing import Any, Callable, List, Mapping, Optional, Tuple
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# (callback, is a coroutine function, is passed the resource name, is deferred)
+Callback = Tuple[Callable, bool, bool, bool]
+
+
+class EventQueue:
+    """Bounded in process queue for deferred callbacks, drained by worker
+    tasks (sync callbacks run in the thread pool) so they do not add to the
+    response time. When the queue is full callbacks are dropped or the
+    request waits for room, depending on overflow ("drop" or "block").
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1000,
+        workers: int = 1,
+        overflow: str = "drop",
+        drain_timeout: float = 10.0,
+    ) -> None:
+        if overflow not in ("drop", "block"):
+            raise ValueError(f"Invalid overflow '{overflow}' (drop or block)")
+        self.maxsize = maxsize
+        self.workers = workers
+        self.overflow = overflow
+        self.drain_timeout = drain_timeout
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def start(self) -> None:
+        if self.queue is None:
+            self.queue = asyncio.Queue(self.maxsize)
+            self.tasks = [
+                asyncio.ensure_future(self.worker()) for _ in range(self.workers)
+            ]
+
+    async def stop(self) -> None:
+        """Wait (up to drain_timeout) for queued callbacks then stop the workers"""
+        if self.queue is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Dropped {self.queue.qsize()} deferred event callbacks on shutdown"
+            )
+            self.dropped += self.queue.qsize()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.queue = None
+        self.tasks = []
+
+    async def put(self, func: Callable, is_coroutine: bool, args: tuple) -> None:
+        self.start()
+        item = (func, is_coroutine, args)
+        if self.overflow == "block":
+            await self.queue.put(item)  # type: ignore
+            return
+        try:
+            self.queue.put_nowait(item)  # type: ignore
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"Event queue is full, dropped {func.__name__}")
+
+    async def worker(self) -> None:
+        while True:
+            func, is_coroutine, args = await self.queue.get()  # type: ignore
+            try:
+                if is_coroutine:
+                    await func(*args)
+                else:
+                    await run_in_threadpool(func, *args)
+                self.completed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception(f"Deferred event callback {func.__name__} failed")
+            finally:
+                self.queue.task_done()  # type: ignore
+
+    def stats(self) -> dict:
+        return {
+            "size": self.maxsize,
+            "queued": self.queue.qsize() if self.queue else 0,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+
+class Deferred:
+    """Event list entry of a callback registered with deferred=True. Equal to
+    the callback so it can be removed from the list like any other.
+    """
+
+    def __init__(self, func: Callable) -> None:
+        self.func = func
+
+    def __call__(self, *args: Any) -> Any:
+        return self.func(*args)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Deferred):
+            return self.func == other.func
+        return self.func == other
+
+    def __hash__(self) -> int:
+        return hash(self.func)
 
 
 class Events:
-    def __init__(self, resources: list) -> None:
+    def __init__(
+        self,
+        resources: list,
+        concurrent_after: bool = False,
+        queue: Optional[EventQueue] = None,
+    ) -> None:
         self.METHODS = ["GET", "HEAD", "POST", "DELETE", "PUT", "PATCH"]
         self.resources = resources
+        self.concurrent_after = concurrent_after
+        self.queue = queue or EventQueue()
+        self.names: List[str] = []
+        self.table: Optional[Mapping[Tuple[str, str], Tuple[Callback, ...]]] = None
 
         # request events
         for method in self.METHODS:
-            setattr(self, f"before_{method}", [])
-            setattr(self, f"after_{method}", [])
-
-        for resource in self.resources:
-            for method in self.METHODS:
-                setattr(self, f"before_{method}_{resource.name}", [])
-                setattr(self, f"after_{method}_{resource.name}", [])
+            self.names += [f"before_{method}", f"after_{method}"]
 
         # db events
         self.add("after", "read", levels=["resource", "item"])
@@ -27,25 +147,87 @@ class Events:
         self.add("before", "delete", levels=["resource", "item"])
         self.add("after", "delete", levels=["resource", "item"])
 
+        for name in self.names:
+            setattr(self, name, [])
+            for resource in self.resources:
+                setattr(self, f"{name}_{resource.name}", [])
+
     def add(self, timing: str, action: str, levels: list) -> None:
         assert timing in ("before", "after")
 
         for level in levels:
-            setattr(self, f"{timing}_{action}_{level}", [])
-
-        for resource in self.resources:
-            for level in levels:
-                setattr(self, f"{timing}_{action}_{level}_{resource.name}", [])
-
-    async def run_callbacks(self, callbacks: list, *args: str) -> None:
-        for func in callbacks:
-            if iscoroutinefunction(func):
-                await func(*args)
-            else:
-                func(*args)
-
-    async def run(self, event: str, resource_name: str, *args: str) -> None:
-        callbacks = getattr(self, event)
-        await self.run_callbacks(callbacks, resource_name, *args)
-        callbacks = getattr(self, f"{event}_{resource_name}")
-        await self.run_callbacks(callbacks, *args)
+            name = f"{timing}_{action}_{level}"
+            self.names.append(name)
+            if self.table is not None:
+                setattr(self, name, [])
+                for resource in self.resources:
+                    setattr(self, f"{name}_{resource.name}", [])
+                self.compile()
+
+    def register(self, event: str, func: Callable, deferred: bool = False) -> None:
+        """Add a callback to event. Deferred callbacks are queued and run after
+        the response (only after_* events, before_* callbacks can change the
+        request).
+        """
+        if deferred:
+            if not event.startswith("after"):
+                raise ValueError(f"Only after events can be deferred ({event})")
+            func = Deferred(func)
+        getattr(self, event).append(func)
+        if self.table is not None:
+            # registered after the app started
+            self.compile()
+
+    def compile(self) -> None:
+        """Build the (event, resource name) -> callbacks lookup used by run.
+        Events without callbacks are left out so run returns straight away.
+        """
+        table = {}
+        for name in self.names:
+            for resource in self.resources:
+                callbacks = [
+                    self.callback(func, with_name=True) for func in getattr(self, name)
+                ] + [
+                    self.callback(func, with_name=False)
+                    for func in getattr(self, f"{name}_{resource.name}")
+                ]
+                if callbacks:
+                    table[(name, resource.name)] = tuple(callbacks)
+        self.table = MappingProxyType(table)
+
+    def callback(self, func: Callable, with_name: bool) -> Callback:
+        if isinstance(func, Deferred):
+            return (func.func, iscoroutinefunction(func.func), with_name, True)
+        return (func, iscoroutinefunction(func), with_name, False)
+
+    def has_callbacks(self, event: str, resource_name: str) -> bool:
+        """Are there callbacks for event (for every or this resource)?"""
+        if self.table is None:
+            self.compile()
+        return (event, resource_name) in self.table  # type: ignore
+
+    async def run(self, event: str, resource_name: str, *args: Any) -> None:
+        if self.table is None:
+            self.compile()
+        callbacks = self.table.get((event, resource_name))  # type: ignore
+        if not callbacks:
+            return
+        if self.concurrent_after and len(callbacks) > 1 and event.startswith("after"):
+            # after callbacks are independent of each other
+            await asyncio.gather(
+                *[self.call(callback, resource_name, *args) for callback in callbacks]
+            )
+            return
+        for callback in callbacks:
+            await self.call(callback, resource_name, *args)
+
+    async def call(self, callback: Callback, resource_name: str, *args: Any) -> None:
+        func, is_coroutine, with_name, deferred = callback
+        if with_name:
+            args = (resource_name, *args)
+        if deferred:
+            await self.queue.put(func, is_coroutine, args)
+        elif is_coroutine:
+            await func(*args)
+        else:
+            func(*args)
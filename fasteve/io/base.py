@@ -9,8 +9,10 @@
     :copyright: (c) 2017 by Nicola Iarocci.
     :license: BSD, see LICENSE for more details.
 """
-from typing import Optional, List, Tuple
-from fasteve.resource import Resource
+from typing import Any, AsyncIterator, Dict, Optional, List, Tuple
+from fasteve.resource import Index, Resource
+from fasteve.io.indexes import IndexManager
+from fasteve.core.cache import TTLCache, cache_key
 
 
 class ConnectionException(Exception):
@@ -34,6 +36,10 @@ class ConnectionException(Exception):
         return msg
 
 
+class QueryTimeout(Exception):
+    """Raised when a query runs longer than its max_time_ms"""
+
+
 class DataLayer:
     """Base data layer class. Defines the interface that actual data-access
     classes, being subclasses, must implement.
@@ -56,6 +62,10 @@ class DataLayer:
             self.app = app
         else:
             self.app = None
+        self.count_caches: Dict[str, TTLCache] = {}
+        self.alt_id_caches: Dict[str, TTLCache] = {}
+        self.item_caches: Dict[str, TTLCache] = {}
+        self.indexes = IndexManager(self)
 
     def init_app(self) -> None:
         """This is where you want to initialize the db driver so it will be
@@ -66,13 +76,23 @@ class DataLayer:
     async def get_collection(self, resource: Resource) -> None:
         raise NotImplementedError
 
-    def connect(self) -> None:
+    async def connect(self) -> None:
         raise NotImplementedError
 
-    def close(self) -> None:
+    async def close(self) -> None:
         raise NotImplementedError
 
-    async def find(self, resource: Resource, args: dict) -> Tuple[List[dict], int]:
+    async def find(
+        self,
+        resource: Resource,
+        query: dict = {},
+        skip: int = 0,
+        limit: int = 0,
+        sort: Optional[List[Tuple[str, int]]] = None,
+        seek: Optional[dict] = None,
+        projection: Optional[dict] = None,
+        max_time_ms: Optional[int] = None,
+    ) -> Tuple[List[dict], Optional[int]]:
         """Retrieves a set of documents (rows), matching the current request.
         Consumed when a request hits a collection/document endpoint
         (`/people/`).
@@ -81,26 +101,146 @@ class DataLayer:
                          the ``datasource`` helper function to retrieve both
                          the db collection/table and base query (filter), if
                          any.
-        :param req: an instance of ``eve.utils.ParsedRequest``. This contains
-                    all the constraints that must be fulfilled in order to
-                    satisfy the original request (where and sort parts, paging,
-                    etc). Be warned that `where` and `sort` expressions will
-                    need proper parsing, according to the syntax that you want
-                    to support with your driver. For example ``eve.io.Mongo``
-                    supports both Python and Mongo-like query syntaxes.
-        :param sub_resource_lookup: sub-resource lookup from the endpoint url.
-        :param perform_count: wether a document count should be performed and
-                              returned to the client.
+        :param query: mongo style filter (see ``fasteve.core.query``).
+        :param skip: number of documents to skip.
+        :param limit: max number of documents to return (0 for no limit).
+        :param sort: list of (field, 1 or -1) pairs.
+        :param seek: filter applied to the page but not the count (keyset
+                     pagination).
+        :param projection: fields to include (1) or exclude (0), see
+                           ``fasteve.core.query.parse_projection``.
+        :param max_time_ms: time limit of the query (and count), raises
+                            ``QueryTimeout`` when exceeded.
+
+        Returns the documents and the total count of documents matching
+        query, as returned by ``count`` (None if the resource is not counted).
+        """
+        raise NotImplementedError
+
+    def find_stream(
+        self,
+        resource: Resource,
+        query: dict = {},
+        sort: Optional[List[Tuple[str, int]]] = None,
+        projection: Optional[dict] = None,
+        batch_size: int = 1000,
+        max_time_ms: Optional[int] = None,
+    ) -> AsyncIterator[dict]:
+        """Yields every document (row) matching query, fetching batch_size at
+        a time so the whole result is never held in memory. Use it instead of
+        find when all the documents are needed (find is capped).
+        max_time_ms limits the query, raises ``QueryTimeout`` when exceeded.
         """
         raise NotImplementedError
 
+    async def count(
+        self, resource: Resource, query: dict, max_time_ms: Optional[int] = None
+    ) -> Optional[int]:
+        """Counts the documents (rows) matching query using the resource
+        count strategy:
+
+        exact: count every match.
+        estimated: use collection/table statistics when there is no filter.
+        cached: exact count cached for resource.count_cache_ttl seconds and
+                cleared by writes to the resource.
+        none: don't count (returns None).
+        """
+        if resource.count == "none":
+            return None
+        if resource.count == "estimated" and not query:
+            return await self.count_estimated(resource)
+        if resource.count == "cached":
+            cache = self.get_count_cache(resource)
+            key = cache_key(query)
+            count = cache.get(key)
+            if count is None:
+                # not cached if a write clears the cache while counting
+                generation = cache.generation
+                count = await self.count_exact(resource, query, max_time_ms)
+                cache.set(key, count, generation)
+            return count
+        return await self.count_exact(resource, query, max_time_ms)
+
+    async def count_exact(
+        self, resource: Resource, query: dict, max_time_ms: Optional[int] = None
+    ) -> int:
+        raise NotImplementedError
+
+    async def count_estimated(self, resource: Resource) -> int:
+        """Fast approximate count of the whole collection/table. Data layers
+        without statistics fall back to an exact count.
+        """
+        return await self.count_exact(resource, {})
+
+    def get_count_cache(self, resource: Resource) -> TTLCache:
+        if resource.name not in self.count_caches:
+            self.count_caches[resource.name] = TTLCache(resource.count_cache_ttl)
+        return self.count_caches[resource.name]
+
+    def invalidate(self, resource: Resource) -> None:
+        """Clears cached state for resource. Called after every write."""
+        if resource.name in self.count_caches:
+            self.count_caches[resource.name].clear()
+        if resource.name in self.alt_id_caches:
+            self.alt_id_caches[resource.name].clear()
+        if resource.name in self.item_caches:
+            self.item_caches[resource.name].clear()
+
+    def get_item_cache(self, resource: Resource) -> TTLCache:
+        """Cache of item GETs (see resource.item_cache), stats() has the
+        hit/miss/eviction counters.
+        """
+        if resource.name not in self.item_caches:
+            self.item_caches[resource.name] = TTLCache(
+                resource.item_cache_ttl, maxsize=resource.item_cache
+            )
+        return self.item_caches[resource.name]
+
+    async def resolve_alt_id(self, resource: Resource, value: Any) -> Optional[Any]:
+        """Primary key of the item with resource.alt_id value (None if there
+        is none). Lookups are cached for ALT_ID_CACHE_TTL seconds and cleared
+        by writes to the resource.
+        """
+        if resource.name not in self.alt_id_caches:
+            self.alt_id_caches[resource.name] = TTLCache(
+                self.app.config.ALT_ID_CACHE_TTL
+            )
+        cache = self.alt_id_caches[resource.name]
+        item_id = cache.get(value)
+        if item_id is None:
+            # not cached if a write clears the cache during the lookup
+            generation = cache.generation
+            pk = resource.model.get_primary_key()  # type: ignore
+            item = await self.find_one(resource, {resource.alt_id: value}, {pk: 1})  # type: ignore
+            if not item:
+                return None
+            item_id = item[pk]
+            cache.set(value, item_id, generation)
+        return item_id
+
+    def index_name(self, resource: Resource, index: Index) -> str:
+        """Default name of an index e.g. name_1_age_-1"""
+        return "_".join(f"{field}_{direction}" for field, direction in index.fields)  # type: ignore
+
+    def model_indexes(self, resource: Resource) -> List[Index]:
+        """Indexes implied by the model, used to check query coverage"""
+        return [Index([resource.model.get_primary_key()])]  # type: ignore
+
+    async def get_index_names(self, resource: Resource) -> List[str]:
+        """Names of the indexes that exist on the resource collection/table"""
+        raise NotImplementedError
+
+    async def create_index(self, resource: Resource, index: Index) -> None:
+        raise NotImplementedError
+
     async def aggregate(
         self,
         resource: Resource,
-        pipline: List[dict] = [],
+        pipeline: Optional[List[dict]] = None,
         skip: int = 0,
         limit: int = 0,
-    ) -> Tuple[List[dict], int]:
+        max_time_ms: Optional[int] = None,
+    ) -> Tuple[List[dict], Optional[int]]:
         """Perform an aggregation on the resource datasource and returns
         the result. Only implent this if the underlying db engine supports
         aggregation operations.
@@ -108,12 +248,30 @@ class DataLayer:
         :param resource: resource being accessed. You should then use
                          the ``datasource`` helper function to retrieve
                          the db collection/table consumed by the resource.
-        :param pipeline: aggregation pipeline to be executed.
-        :param options: aggregation options to be considered.
+        :param pipeline: aggregation pipeline to be executed (not modified).
+        :param skip: number of documents to skip.
+        :param limit: max number of documents to return (0 for no limit).
+        :param max_time_ms: time limit of the aggregation (and count), raises
+                            ``QueryTimeout`` when exceeded.
+
+        Returns the documents and the total count, as for ``find``.
         """
         raise NotImplementedError
 
-    async def find_one(self, resource: Resource, lookup: dict) -> Optional[dict]:
+    def aggregate_stream(
+        self,
+        resource: Resource,
+        pipeline: Optional[List[dict]] = None,
+        batch_size: int = 1000,
+    ) -> AsyncIterator[dict]:
+        """Yields every document returned by pipeline, batch_size at a time
+        (see find_stream).
+        """
+        raise NotImplementedError
+
+    async def find_one(
+        self, resource: Resource, lookup: dict, projection: Optional[dict] = None
+    ) -> Optional[dict]:
         """Retrieves a single document/record. Consumed when a request hits an
         item endpoint (`/people/id/`).
 
@@ -151,16 +309,18 @@ class DataLayer:
         """
         raise NotImplementedError
 
-    def find_list_of_ids(self, resource: Resource, ids: List) -> None:
+    async def find_list_of_ids(
+        self, resource: Resource, ids: List, projection: Optional[dict] = None
+    ) -> List[dict]:
         """Retrieves a list of documents based on a list of primary keys
-        The primary key is the field defined in `ID_FIELD`.
+        (in no particular order, missing ids are left out).
         This is a separate function to allow us to use per-database
         optimizations for this type of query.
 
         :param resource: resource name.
         :param ids: a list of ids corresponding to the documents
         to retrieve
-        :param client_projection: a specific projection to use
+        :param projection: a specific projection to use
         :return: a list of documents matching the ids in `ids` from the
         collection specified in `resource`
         """
@@ -235,11 +395,15 @@ class DataLayer:
         """
         raise NotImplementedError
 
-    def combine_queries(self, query_a: dict, query_b: dict) -> None:
-        """Takes two db queries and applies db-specific syntax to produce
-        the intersection.
+    def combine_queries(self, query_a: dict, query_b: dict) -> dict:
+        """Takes two db queries and produces the intersection. Queries use
+        the mongo style syntax (see fasteve.core.query) for every data layer.
         """
-        raise NotImplementedError
+        if not query_a:
+            return query_b
+        if not query_b:
+            return query_a
+        return {"$and": [query_a, query_b]}
 
     def get_value_from_query(self, query: dict, field_name: str) -> None:
         """Parses the given potentially-complex query and returns the value
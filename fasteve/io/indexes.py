@@ -0,0 +1,207 @@
+from fasteve.resource import Index, Resource
+from fasteve.core.query import InvalidQuery
+from fasteve.core.utils import is_new_type
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class IndexManager:
+    """Creates the indexes declared on the resources of a data layer.
+
+    Declared indexes are the Unique fields of the resource model,
+    resource.indexes, the alt_id and the id_field of sub resources. At
+    startup (see start) they are compared with the indexes that already
+    exist, by name, and the missing ones are created in the background. In
+    dry-run mode the missing indexes are only reported.
+
+    Queries are checked against the indexes using resource.index_policy.
+    """
+
+    def __init__(self, data) -> None:  # type: ignore
+        self.data = data
+        self.report: Dict[str, List[str]] = {}
+        self.errors: Dict[str, Dict[str, str]] = {}  # resource -> index -> error
+        self.task: Optional[asyncio.Task] = None
+        self.warned: Set[tuple] = set()
+        # per resource, looked up by the query checks (see refresh)
+        self.sort_keys: Dict[str, List[List[Tuple[str, int]]]] = {}
+        self.leading_fields: Dict[str, Set[str]] = {}
+
+    def declared(self, resource: Resource) -> List[Index]:
+        indexes = []
+        fields = resource.model.__fields__
+        for name in fields:
+            if is_new_type(fields[name].type_):
+                indexes.append(Index([name], unique=True))
+        indexes += resource.indexes
+        # alt_id and sub resource lookups are equality matches on one field
+        lookups = [resource.alt_id] if resource.alt_id else []
+        for parent in getattr(self.data.app, "resources", []):
+            lookups += [
+                sub_resource.id_field
+                for sub_resource in parent.sub_resources
+                if sub_resource.resource is resource
+            ]
+        for field in lookups:
+            if not any(index.fields[0][0] == field for index in indexes):
+                indexes.append(Index([field]))
+        for index in indexes:
+            if not index.name:
+                index.name = self.data.index_name(resource, index)
+        return indexes
+
+    def covering(self, resource: Resource) -> List[Index]:
+        """Declared indexes and the indexes the data layer knows about from
+        the model (e.g. the primary key)
+        """
+        return self.declared(resource) + self.data.model_indexes(resource)
+
+    def refresh(self) -> None:
+        """Compute the covering index keys of every resource once (at start
+        and after ensure) instead of on every checked query.
+        """
+        self.sort_keys = {}
+        self.leading_fields = {}
+        for resource in getattr(self.data.app, "resources", []):
+            self.refresh_resource(resource)
+
+    def refresh_resource(self, resource: Resource) -> None:
+        indexes = self.covering(resource)
+        self.sort_keys[resource.name] = [list(index.fields) for index in indexes]  # type: ignore
+        self.leading_fields[resource.name] = {index.fields[0][0] for index in indexes}  # type: ignore
+
+    def covers_sort(self, resource: Resource, sort: List[Tuple[str, int]]) -> bool:
+        """An index covers a sort if the sort is a prefix of the index keys
+        in the same (or the exact opposite) direction.
+        """
+        if resource.name not in self.sort_keys:
+            self.refresh_resource(resource)
+        reverse = [(field, -direction) for field, direction in sort]
+        for index_keys in self.sort_keys[resource.name]:
+            keys = index_keys[: len(sort)]
+            if keys == sort or keys == reverse:
+                return True
+        return False
+
+    def check_sort(self, resource: Resource, sort: List[Tuple[str, int]]) -> None:
+        """Apply resource.index_policy to a sort that no index covers"""
+        if resource.index_policy == "allow" or self.covers_sort(resource, sort):
+            return
+        if resource.index_policy == "reject":
+            raise InvalidQuery("sort is not covered by an index")
+        key = (resource.name, "sort", tuple(sort))
+        if key not in self.warned:
+            # once per sort to keep the log readable
+            self.warned.add(key)
+            logger.warning(f"Sort {sort} on {resource.name} is not covered by an index")
+
+    def covers_field(self, resource: Resource, field: str) -> bool:
+        """A filter on field can use an index that starts with it"""
+        if resource.name not in self.leading_fields:
+            self.refresh_resource(resource)
+        return field in self.leading_fields[resource.name]
+
+    def check_filter(self, resource: Resource, fields: List[str]) -> bool:
+        """Apply resource.allowed_filters and resource.index_policy to the
+        fields of a where filter. Returns True if the filter uses unindexed
+        fields and should run within resource.slow_query_budget.
+        """
+        allowed = resource.allowed_filters
+        for field in fields:
+            if allowed is True or (allowed and ("*" in allowed or field in allowed)):  # type: ignore
+                continue
+            raise InvalidQuery(f"field '{field}' is not filterable")
+        unindexed = [f for f in fields if not self.covers_field(resource, f)]
+        if not unindexed:
+            return False
+        if resource.slow_query_budget:
+            return True
+        if resource.index_policy == "reject":
+            raise InvalidQuery(f"field '{unindexed[0]}' is not covered by an index")
+        key = (resource.name, "filter", tuple(unindexed))
+        if resource.index_policy == "warn" and key not in self.warned:
+            self.warned.add(key)
+            logger.warning(
+                f"Filter on {unindexed} in {resource.name} is not covered by an index"
+            )
+        return False
+
+    async def missing(self, resource: Resource) -> List[Index]:
+        existing = await self.data.get_index_names(resource)
+        return [
+            index for index in self.declared(resource) if index.name not in existing
+        ]
+
+    async def ensure(self, dry_run: bool = False) -> Dict[str, List[str]]:
+        """Create (or with dry_run only report) the missing indexes of every
+        resource. Returns the names of the missing indexes by resource.
+
+        An index that can't be created (e.g. unique over duplicates) is
+        logged and recorded in errors, the other indexes are still created.
+        """
+        report: Dict[str, List[str]] = {}
+        errors: Dict[str, Dict[str, str]] = {}
+        for resource in self.data.app.resources:
+            try:
+                missing = await self.missing(resource)
+            except Exception as e:
+                logger.error(f"Could not list the indexes of {resource.name}: {e!r}")
+                errors[resource.name] = {"*": repr(e)}
+                continue
+            for index in missing:
+                if dry_run:
+                    logger.info(f"Missing index {index.name} in {resource.name}")
+                    continue
+                try:
+                    await self.data.create_index(resource, index)
+                except Exception as e:
+                    logger.error(
+                        f"Could not create index {index.name} in {resource.name}: {e!r}"
+                    )
+                    errors.setdefault(resource.name, {})[index.name] = repr(e)  # type: ignore
+                else:
+                    logger.info(f"Created index {index.name} in {resource.name}")
+            report[resource.name] = [index.name for index in missing]  # type: ignore
+        self.report = report
+        self.errors = errors
+        self.refresh()
+        return report
+
+    def start(self) -> None:
+        """Run ensure in the background using config.INDEX_MODE (create,
+        dry-run or off).
+        """
+        mode = self.data.app.config.INDEX_MODE
+        if mode not in ("create", "dry-run", "off"):
+            raise ValueError(f"Invalid INDEX_MODE '{mode}' (create, dry-run or off)")
+        try:
+            self.refresh()
+        except Exception:
+            # the query checks compute the keys per resource when needed
+            logger.exception("Could not compute the covering indexes")
+        if mode != "off":
+            self.task = asyncio.create_task(self.run(dry_run=mode == "dry-run"))
+
+    async def run(self, dry_run: bool = False) -> None:
+        try:
+            await self.ensure(dry_run=dry_run)
+        except Exception:
+            # don't stop the app because an index could not be created
+            logger.exception("Index creation failed")
+
+    async def wait(self) -> None:
+        """Wait for the background index creation to finish"""
+        if self.task:
+            await self.task
+
+    async def stop(self) -> None:
+        if self.task and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
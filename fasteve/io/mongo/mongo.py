@@ -1,10 +1,26 @@
-from fasteve.io.base import ConnectionException, DataLayer
+from fasteve.io.base import ConnectionException, DataLayer, QueryTimeout
 from fastapi import HTTPException
-from fasteve.resource import Resource
+from fasteve.resource import Index, Resource
 from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, ExecutionTimeout
+from pymongo.write_concern import WriteConcern
 from motor.motor_asyncio import AsyncIOMotorClient
+from fasteve.core.cache import cache_key
 from fasteve.core.utils import log
-from typing import List, Tuple
+from typing import AsyncIterator, List, Optional, Tuple
+import asyncio
+
+
+# stages that never change the number of documents
+COUNT_PRESERVING_STAGES = ("$sort", "$project", "$addFields", "$set", "$unset")
+
+
+def count_stages(pipeline: List[dict]) -> List[dict]:
+    """pipeline without the trailing stages that don't change the count"""
+    stages = list(pipeline)
+    while stages and list(stages[-1])[0] in COUNT_PRESERVING_STAGES:
+        stages.pop()
+    return stages
 
 
 class DataBase:
@@ -55,47 +71,137 @@ class MongoDataLayer(DataLayer):
             client = MongoClient.get_database()
         except Exception as e:
             HTTPException(500, e)
-        return client[self.app.config.MONGODB_NAME][resource.name]
+        collection = client[self.app.config.MONGODB_NAME][resource.name]
+        if resource.write_concern is not None:
+            collection = collection.with_options(
+                write_concern=WriteConcern(**resource.write_concern)
+            )
+        return collection
 
-    def connect(self) -> None:
+    async def connect(self) -> None:
         MongoClient.connect(
             self.app.config.MONGODB_URI, self.app.config.CONNECTION_TIMEOUT
         )
+        self.indexes.start()
 
-    def close(self) -> None:
+    async def close(self) -> None:
+        await self.indexes.stop()
         MongoClient.close()
 
+    async def get_index_names(self, resource: Resource) -> List[str]:
+        collection = await self.get_collection(resource)
+        return list(await collection.index_information())
+
+    async def create_index(self, resource: Resource, index: Index) -> None:
+        collection = await self.get_collection(resource)
+        options: dict = {"name": index.name, "unique": index.unique}
+        if index.sparse:
+            options["sparse"] = True
+        if index.ttl is not None:
+            options["expireAfterSeconds"] = index.ttl
+        if index.partial:
+            options["partialFilterExpression"] = index.partial
+        await collection.create_index(index.fields, **options)  # type: ignore
+
     async def aggregate(
         self,
         resource: Resource,
-        pipline: List[dict] = [],
+        pipeline: Optional[List[dict]] = None,
         skip: int = 0,
         limit: int = 0,
-    ) -> Tuple[List[dict], int]:
-        collection = await self.get_collection(resource)
-
-        paginated_results: List[dict] = []
-        paginated_results.append({"$skip": skip})
-        paginated_results.append({"$limit": limit})
-        facet_pipelines: dict = {}
-        facet_pipelines["paginated_results"] = paginated_results
-        facet_pipelines["total_count"] = list({"$count": "count"})
-        facet = {"$facet": facet_pipelines}
-        pipline.append(facet)
-        count = 0
+        max_time_ms: Optional[int] = None,
+    ) -> Tuple[List[dict], Optional[int]]:
+        """Runs the page ($skip/$limit appended to a copy of pipeline) and the
+        count (see count_aggregate) as separate, concurrent aggregations
+        instead of a single $facet, which holds every match in one 16MB
+        document and can't use indexes to count.
+        """
+        collection = await self.get_collection(resource)
+        stages = list(pipeline or [])
+        if skip:
+            stages.append({"$skip": skip})
+        if limit > 0:
+            stages.append({"$limit": limit})
+        cursor = collection.aggregate(stages, **self.aggregate_options(max_time_ms))
         try:
-            async for res in collection.aggregate(pipline):
-                items = res["paginated_results"]
-                if res["total_count"]:
-                    # IndexError: list index out of range
-                    count = res["total_count"][0]["count"]
+            items, count = await asyncio.gather(
+                cursor.to_list(length=None),
+                self.count_aggregate(resource, pipeline or [], max_time_ms),
+            )
+        except ExecutionTimeout as e:
+            raise QueryTimeout(e)
         except Exception as e:
             raise e
         return items, count
 
+    async def aggregate_stream(
+        self,
+        resource: Resource,
+        pipeline: Optional[List[dict]] = None,
+        batch_size: int = 1000,
+    ) -> AsyncIterator[dict]:
+        """Iterates the aggregation cursor"""
+        collection = await self.get_collection(resource)
+        options = self.aggregate_options()
+        cursor = collection.aggregate(
+            list(pipeline or []), batchSize=batch_size, **options
+        )
+        async for document in cursor:
+            yield document
+
+    def aggregate_options(self, max_time_ms: Optional[int] = None) -> dict:
+        options: dict = {"allowDiskUse": self.app.config.MONGODB_ALLOW_DISK_USE}
+        if max_time_ms:
+            options["maxTimeMS"] = max_time_ms
+        return options
+
+    async def count_aggregate(
+        self,
+        resource: Resource,
+        pipeline: List[dict],
+        max_time_ms: Optional[int] = None,
+    ) -> Optional[int]:
+        """Counts the documents returned by pipeline using the resource count
+        strategy (see count). Pipelines that only filter are counted with
+        count_documents, otherwise a $count is appended to the stages that
+        can change the number of documents.
+        """
+        stages = count_stages(pipeline)
+        if all(list(stage) == ["$match"] for stage in stages):
+            query: dict = {}
+            for stage in stages:
+                query = self.combine_queries(query, stage["$match"])
+            return await self.count(resource, query, max_time_ms)
+        if resource.count == "none":
+            return None
+        cache = self.get_count_cache(resource)
+        key = cache_key(stages)
+        if resource.count == "cached":
+            count = cache.get(key)
+            if count is not None:
+                return count
+        generation = cache.generation
+        collection = await self.get_collection(resource)
+        cursor = collection.aggregate(
+            stages + [{"$count": "count"}], **self.aggregate_options(max_time_ms)
+        )
+        result = await cursor.to_list(length=1)
+        count = result[0]["count"] if result else 0
+        if resource.count == "cached":
+            cache.set(key, count, generation)
+        return count
+
     async def find(
-        self, resource: Resource, query: dict = {}, skip: int = 0, limit: int = 0
-    ) -> Tuple[List[dict], int]:
+        self,
+        resource: Resource,
+        query: dict = {},
+        skip: int = 0,
+        limit: int = 0,
+        sort: Optional[List[Tuple[str, int]]] = None,
+        seek: Optional[dict] = None,
+        projection: Optional[dict] = None,
+        max_time_ms: Optional[int] = None,
+    ) -> Tuple[List[dict], Optional[int]]:
         """Retrieves a set of documents matching a given request. Queries can
         be expressed in two different formats: the mongo query syntax, and the
         python syntax. The first kind of query would look like: ::
@@ -103,29 +209,90 @@ class MongoDataLayer(DataLayer):
         while the second would look like: ::
             ?where=name=="john doe"
         :param resource: Resource object.
+        :param sort: list of (field, 1 or -1) pairs.
+        :param seek: filter applied to the page but not the count
+                     (keyset pagination).
+        :param projection: mongo projection of the returned fields.
+        :param max_time_ms: maxTimeMS of the find and count.
         """
         # process_query(q)
         collection = await self.get_collection(resource)
-        items = []
-        # Perform find and iterate results
-        # https://motor.readthedocs.io/en/stable/tutorial-asyncio.html#async-for
+        page_query = self.combine_queries(query, seek or {})
+        cursor = collection.find(
+            page_query, projection or None, skip=skip, limit=limit, sort=sort
+        )
+        if limit:
+            # return the whole page in the first batch (default is 101 docs)
+            cursor = cursor.batch_size(limit)
+        if max_time_ms:
+            cursor = cursor.max_time_ms(max_time_ms)
+        # the page and the count are independent round trips so run them
+        # concurrently
         try:
-            async for row in collection.find(query, skip=skip, limit=limit):
-                items.append(row)
+            items, count = await asyncio.gather(
+                cursor.to_list(length=limit or None),
+                self.count(resource, query, max_time_ms),
+            )
+        except ExecutionTimeout as e:
+            raise QueryTimeout(e)
         except Exception as e:
             raise e
-        count = await collection.count_documents(query)
         return items, count
 
-    async def find_one(self, resource: Resource, query: dict) -> dict:
+    async def find_stream(
+        self,
+        resource: Resource,
+        query: dict = {},
+        sort: Optional[List[Tuple[str, int]]] = None,
+        projection: Optional[dict] = None,
+        batch_size: int = 1000,
+        max_time_ms: Optional[int] = None,
+    ) -> AsyncIterator[dict]:
+        """Iterates a server side cursor"""
+        collection = await self.get_collection(resource)
+        cursor = collection.find(
+            query, projection or None, sort=sort, batch_size=batch_size
+        )
+        if max_time_ms:
+            cursor = cursor.max_time_ms(max_time_ms)
+        try:
+            async for document in cursor:
+                yield document
+        except ExecutionTimeout as e:
+            raise QueryTimeout(e)
+
+    async def count_exact(
+        self, resource: Resource, query: dict, max_time_ms: Optional[int] = None
+    ) -> int:
+        collection = await self.get_collection(resource)
+        if max_time_ms:
+            return await collection.count_documents(query, maxTimeMS=max_time_ms)
+        return await collection.count_documents(query)
+
+    async def count_estimated(self, resource: Resource) -> int:
+        """Uses the collection metadata instead of scanning"""
+        collection = await self.get_collection(resource)
+        return await collection.estimated_document_count()
+
+    async def find_one(
+        self, resource: Resource, query: dict, projection: Optional[dict] = None
+    ) -> dict:
         """"""
         collection = await self.get_collection(resource)
         try:
-            item = await collection.find_one(query)
+            item = await collection.find_one(query, projection or None)
         except Exception as e:
             raise e
         return item
 
+    async def find_list_of_ids(
+        self, resource: Resource, ids: List, projection: Optional[dict] = None
+    ) -> List[dict]:
+        """"""
+        collection = await self.get_collection(resource)
+        cursor = collection.find({"_id": {"$in": ids}}, projection or None)
+        return await cursor.to_list(length=None)
+
     @log
     async def create(self, resource: Resource, payload: dict) -> dict:
         """"""
@@ -134,15 +301,68 @@ class MongoDataLayer(DataLayer):
             await collection.insert_one(payload)
         except Exception as e:
             raise e
+        finally:
+            self.invalidate(resource)
         return payload
 
     async def create_many(self, resource: Resource, payload: List[dict]) -> List[dict]:
-        """"""
+        """Inserts documents in chunks of resource.bulk_chunk_size. Ordered
+        inserts run one chunk after the other and stop at the first error,
+        unordered chunks are dispatched concurrently. Errors from every chunk
+        are raised as a single BulkWriteError.
+        """
         collection = await self.get_collection(resource)
+        ordered = resource.bulk_ordered
+        chunk_size = resource.bulk_chunk_size or len(payload) or 1
+        offsets = range(0, len(payload), chunk_size)
+
+        async def insert_chunk(offset: int) -> None:
+            chunk = payload[offset : offset + chunk_size]
+            try:
+                await collection.insert_many(chunk, ordered=ordered)
+            except BulkWriteError as e:
+                # make the indexes relative to the whole payload
+                for error in e.details["writeErrors"]:
+                    error["index"] += offset
+                if ordered:
+                    # the chunks before this one were inserted in full
+                    e.details["nInserted"] = e.details.get("nInserted", 0) + offset  # type: ignore
+                raise e
+
         try:
-            await collection.insert_many(payload)
+            if ordered:
+                for offset in offsets:
+                    await insert_chunk(offset)
+            else:
+                results = await asyncio.gather(
+                    *[insert_chunk(offset) for offset in offsets],
+                    return_exceptions=True,
+                )
+                errors = [e for e in results if isinstance(e, Exception)]
+                bulk_errors = [e for e in errors if isinstance(e, BulkWriteError)]
+                if len(bulk_errors) != len(errors):
+                    raise next(e for e in errors if e not in bulk_errors)
+                if bulk_errors:
+                    raise BulkWriteError(
+                        {
+                            "writeErrors": [
+                                error
+                                for e in bulk_errors
+                                for error in e.details["writeErrors"]
+                            ],
+                            "writeConcernErrors": [
+                                error
+                                for e in bulk_errors
+                                for error in e.details.get("writeConcernErrors", [])
+                            ],
+                            "nInserted": len(payload)
+                            - sum(len(e.details["writeErrors"]) for e in bulk_errors),
+                        }
+                    )
         except Exception as e:
             raise e
+        finally:
+            self.invalidate(resource)
         return payload
 
     async def remove(self, resource: Resource) -> None:
@@ -154,29 +374,53 @@ class MongoDataLayer(DataLayer):
             await collection.delete_many({})
         except Exception as e:
             raise e
+        finally:
+            self.invalidate(resource)
 
-    async def remove_item(self, resource: Resource, query: dict) -> None:
-        """Removes a single document from a database collection."""
+    async def remove_item(self, resource: Resource, query: dict) -> int:
+        """Removes a single document from a database collection.
+        Returns the number of documents removed.
+        """
         collection = await self.get_collection(resource)
         try:
-            await collection.delete_one(query)
+            result = await collection.delete_one(query)
         except Exception as e:
             raise e
+        finally:
+            self.invalidate(resource)
+        return result.deleted_count
 
     async def replace_item(
-        self, resource: Resource, query: dict, payload: dict
-    ) -> None:
-        """Replaces single document from a database collection"""
+        self, resource: Resource, query: dict, payload: dict, upsert: bool = False
+    ) -> int:
+        """Replaces single document from a database collection. With upsert
+        the document is inserted when nothing matches (a single atomic
+        replace_one). Returns the number of documents matched.
+        """
         collection = await self.get_collection(resource)
         try:
-            await collection.replace_one(query, payload)
+            result = await collection.replace_one(query, payload, upsert=upsert)
         except Exception as e:
             raise e
+        finally:
+            self.invalidate(resource)
+        return result.matched_count
 
-    async def update_item(self, resource: Resource, query: dict, payload: dict) -> None:
-        """Updates single document from a database collection"""
+    async def update_item(self, resource: Resource, query: dict, payload: dict) -> int:
+        """Updates single document from a database collection. The lookup and
+        the update are a single atomic find_one_and_update.
+        Returns the number of documents matched.
+        """
+        if not payload:
+            # nothing to set, only check the item exists
+            return await self.count_exact(resource, query)
         collection = await self.get_collection(resource)
         try:
-            await collection.update_one(query, {"$set": payload})
+            document = await collection.find_one_and_update(
+                query, {"$set": payload}, projection={"_id": True}
+            )
         except Exception as e:
             raise e
+        finally:
+            self.invalidate(resource)
+        return 0 if document is None else 1
@@ -1,4 +1,11 @@
 def render_pymongo_error(details: dict) -> dict:
+    if "keyValue" not in details:
+        # servers before 4.4 only report the error message
+        return {
+            "loc": ["body", "model"],
+            "msg": details.get("errmsg", "value is not unique"),
+            "type": "value_error.not_unique",
+        }
     key = list(details["keyValue"].keys())[0]
     val = details["keyValue"][key]
     msg = {
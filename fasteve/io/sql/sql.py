@@ -1,62 +1,415 @@
-from sqlalchemy import func
-from fasteve.io.base import DataLayer
+from sqlalchemy import Index as SQLIndex, func, inspect, text
+from sqlalchemy import select as select_columns  # cached, unlike sqlmodel Select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from fasteve.io.base import DataLayer, QueryTimeout
 from fasteve.model import SQLModel
-from fasteve.resource import Resource
+from fasteve.resource import Index, Resource
+from fasteve.core.query import keyset_filter
 from fasteve.core.utils import log
-from typing import List, Optional, Tuple, Type
-from sqlmodel import Session, create_engine, select, delete
+import asyncio
+from typing import AsyncIterator, Callable, List, Optional, Tuple, Type, TypeVar
+from itertools import groupby
+from sqlmodel import Session, create_engine, select, delete, insert, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from .threadpool import ThreadPool, engine_pool_size
+from .utils import (
+    all_of,
+    get_column,
+    order_by_clause,
+    projection_columns,
+    where_clause,
+)
+
+T = TypeVar("T")
+
+# async drivers used when SQL_MODE is "async" and the uri names no driver,
+# aiosqlite comes with the async extra (pip install fasteve[async])
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+
+
+def async_uri(uri: str) -> str:
+    """Add the default async driver to a database uri e.g.
+    sqlite:// -> sqlite+aiosqlite://
+    """
+    url = make_url(uri)
+    if "+" in url.drivername:
+        # driver has been set explicitly
+        return uri
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No default async driver for '{backend}' set one in the uri")
+    return str(url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}"))
 
 
 class SQLDataLayer(DataLayer):
     """
     SQLAlchemy data access layer for fasteve.
+
+    In "sync" mode (default) each operation runs a blocking Session on the
+    event loop. In "async" mode the engine is created with an async driver
+    and operations run in an AsyncSession so they don't block other requests.
+    In "threadpool" mode the blocking Session runs in a bounded thread pool
+    (for drivers without async support).
     """
 
+    mode: Optional[str] = None  # defaults to config.SQL_MODE
+    threadpool: Optional[ThreadPool] = None
+
     def __init__(self, app) -> None:  # type: ignore
         super().__init__(app)
+        self.mode = self.mode or self.app.config.SQL_MODE
+        if self.mode not in ("sync", "async", "threadpool"):
+            raise ValueError(
+                f"Invalid SQL_MODE '{self.mode}' (sync, async or threadpool)"
+            )
         connect_args = {}
+        engine_args: dict = {}
         if self.app.config.SQL_URI.startswith("sqlite"):
             # only applied to sqlite connections
             connect_args["check_same_thread"] = False
-        self.engine = create_engine(
-            self.app.config.SQL_URI,
-            echo=self.app.config.SQL_ECHO,
-            connect_args=connect_args,
-        )
+            database = make_url(self.app.config.SQL_URI).database
+            if self.mode != "sync" and database in (None, "", ":memory:"):
+                # share the in memory database between threads/concurrent tasks
+                engine_args["poolclass"] = StaticPool
+        # sessions on a single shared async connection must not interleave
+        self.serialize = self.mode == "async" and "poolclass" in engine_args
+        self.lock: Optional[asyncio.Lock] = None
+        if self.mode == "async":
+            self.engine = create_async_engine(
+                async_uri(self.app.config.SQL_URI),
+                echo=self.app.config.SQL_ECHO,
+                connect_args=connect_args,
+                **engine_args,
+            )
+        else:
+            self.engine = create_engine(  # type: ignore
+                self.app.config.SQL_URI,
+                echo=self.app.config.SQL_ECHO,
+                connect_args=connect_args,
+                **engine_args,
+            )
+        if self.mode == "threadpool":
+            size = self.app.config.SQL_THREADPOOL_SIZE or engine_pool_size(
+                self.engine  # type: ignore
+            )
+            self.threadpool = ThreadPool(size)
 
     def get_model(self, resource: Resource) -> Type[SQLModel]:
         return resource.model  # type: ignore
 
-    def connect(self) -> None:
-        SQLModel.metadata.create_all(self.engine)
+    async def connect(self) -> None:
+        if self.mode == "async":
+            if self.serialize:
+                self.lock = asyncio.Lock()
+            async with self.engine.begin() as conn:
+                await conn.run_sync(SQLModel.metadata.create_all)
+        else:
+            if self.threadpool:
+                self.threadpool.start()
+            SQLModel.metadata.create_all(self.engine)  # type: ignore
+        self.indexes.start()
+
+    async def close(self) -> None:
+        await self.indexes.stop()
+        if self.mode == "async":
+            await self.engine.dispose()
+        else:
+            if self.threadpool:
+                self.threadpool.shutdown()
+            self.engine.dispose()
+
+    async def run(self, func: Callable[[Session], T]) -> T:
+        """Run func with a new Session.
+
+        In async mode func is run with AsyncSession.run_sync so all IO is
+        awaited on the async driver. In threadpool mode func and its Session
+        run in a worker thread.
+        """
+        if self.lock:
+            async with self.lock:
+                async with AsyncSession(self.engine) as session:
+                    return await session.run_sync(func)
+        if self.mode == "async":
+            async with AsyncSession(self.engine) as session:
+                return await session.run_sync(func)
+        if self.threadpool:
+            return await self.threadpool.run(self.run_sync, func)
+        return self.run_sync(func)
+
+    async def write(self, resource: Resource, func: Callable[[Session], T]) -> T:
+        """Run func (see run) and clear cached state for resource"""
+        try:
+            return await self.run(func)
+        finally:
+            self.invalidate(resource)
+
+    def run_sync(self, func: Callable[[Session], T]) -> T:
+        with Session(self.engine) as session:  # type: ignore
+            return func(session)  # type: ignore
+
+    def stats(self) -> dict:
+        """Thread pool counters (empty unless in threadpool mode)"""
+        if self.threadpool:
+            return self.threadpool.stats()
+        return {}
+
+    def index_name(self, resource: Resource, index: Index) -> str:
+        """Named like SQLAlchemy index=True columns e.g. ix_hero_name"""
+        table_name = self.get_model(resource).__tablename__  # type: ignore
+        return f"ix_{table_name}_" + "_".join(field for field, _ in index.fields)  # type: ignore
+
+    def model_indexes(self, resource: Resource) -> List[Index]:
+        """Primary key, index=True and unique columns and Index declarations
+        of the table
+        """
+        table = self.get_model(resource).__table__  # type: ignore
+        indexes = [Index([column.name for column in table.primary_key.columns])]
+        for column in table.columns:
+            if column.unique:
+                indexes.append(Index([column.name], unique=True))
+        for sql_index in table.indexes:
+            columns = [column.name for column in sql_index.columns]
+            if columns:
+                indexes.append(Index(columns, unique=sql_index.unique))  # type: ignore
+        return indexes
+
+    async def get_index_names(self, resource: Resource) -> List[str]:
+        table_name = self.get_model(resource).__tablename__  # type: ignore
 
-    def close(self) -> None:
-        self.engine.dispose()
+        def get_index_names(session: Session) -> List[str]:
+            indexes = inspect(session.connection()).get_indexes(table_name)  # type: ignore
+            return [index["name"] for index in indexes]
+
+        return await self.run(get_index_names)
+
+    async def create_index(self, resource: Resource, index: Index) -> None:
+        """CREATE INDEX, the partial filter is used on postgresql and sqlite.
+        sparse and ttl have no SQL equivalent and are ignored.
+        """
+        Model = self.get_model(resource)
+        columns = []
+        for field, direction in index.fields:  # type: ignore
+            column = get_column(Model, field)
+            columns.append(column.desc() if direction < 0 else column)
+        options = {}
+        if index.partial:
+            where = all_of(where_clause(Model, index.partial))
+            options = {"postgresql_where": where, "sqlite_where": where}
+
+        def create_index(session: Session) -> None:
+            sql_index = SQLIndex(index.name, *columns, unique=index.unique, **options)  # type: ignore
+            sql_index.create(bind=session.connection())
+            session.commit()
+            # keep the model metadata as declared
+            Model.__table__.indexes.discard(sql_index)  # type: ignore
+
+        await self.run(create_index)
 
     async def find(
-        self, resource: Resource, query: dict = {}, skip: int = 0, limit: int = 0
-    ) -> Tuple[List[dict], int]:
+        self,
+        resource: Resource,
+        query: dict = {},
+        skip: int = 0,
+        limit: int = 0,
+        sort: Optional[List[Tuple[str, int]]] = None,
+        seek: Optional[dict] = None,
+        projection: Optional[dict] = None,
+        max_time_ms: Optional[int] = None,
+    ) -> Tuple[List[dict], Optional[int]]:
+        """
+        :param sort: list of (field, 1 or -1) pairs.
+        :param seek: filter applied to the page but not the count
+                     (keyset pagination).
+        :param projection: only select these columns (see
+                           fasteve.core.query.parse_projection).
+        :param max_time_ms: time limit of the find and count (see
+                            limit_time).
+        """
         Model = self.get_model(resource)
-        with Session(self.engine) as session:
-            # where = [getattr(Model, key) == value for key, value in query.items()]
-            statement = select(Model)
+        columns = projection_columns(Model, projection) if projection else None
+        find = self.select_page(Model, query, skip, limit, sort, seek, columns)
+        items = await self.run(self.limit_time(find, max_time_ms))
+        count = await self.count(resource, query, max_time_ms)
+        return items, count
+
+    def select_page(
+        self,
+        Model: Type[SQLModel],
+        query: dict,
+        skip: int,
+        limit: int,
+        sort: Optional[List[Tuple[str, int]]],
+        seek: Optional[dict],
+        columns: Optional[List],
+    ) -> Callable[[Session], List[dict]]:
+        """Session function selecting a page of rows as dicts"""
+        nulls_largest = self.engine.dialect.name in ("postgresql", "oracle")
+
+        def select_page(session: Session) -> List[dict]:
+            statement = select_columns(*columns) if columns else select(Model)  # type: ignore
+            statement = statement.where(*where_clause(Model, query))
+            if seek:
+                statement = statement.where(*where_clause(Model, seek))
+            if sort:
+                statement = statement.order_by(
+                    *order_by_clause(Model, sort, nulls_largest)
+                )
             # offset is bad
             # https://github.com/sqlalchemy/sqlalchemy/wiki/RangeQuery-and-WindowedRangeQuery
-            models = session.exec(statement.offset(skip).limit(limit)).all()  # type: ignore
-            count = int(
-                session.exec(select([func.count()]).select_from(Model)).one()
-            )  # type: ignore
-            return [model.dict() for model in models], count
+            statement = statement.offset(skip).limit(limit)
+            if columns:
+                return [dict(row._mapping) for row in session.execute(statement)]
+            models = session.exec(statement).all()  # type: ignore
+            return [model.dict() for model in models]
+
+        return select_page
+
+    async def find_stream(
+        self,
+        resource: Resource,
+        query: dict = {},
+        sort: Optional[List[Tuple[str, int]]] = None,
+        projection: Optional[dict] = None,
+        batch_size: int = 1000,
+        max_time_ms: Optional[int] = None,
+    ) -> AsyncIterator[dict]:
+        """Selects batch_size rows at a time with keyset pagination on sort
+        and the primary key, so no session is held open between batches (in
+        every SQL_MODE). Projected rows also include the sort keys.
+        max_time_ms limits each batch (see limit_time).
+        """
+        Model = self.get_model(resource)
+        pk = Model.get_primary_key()
+        keys = list(sort or [])
+        if pk not in [field for field, _ in keys]:
+            keys.append((pk, 1))
+        columns = None
+        if projection:
+            columns = projection_columns(Model, projection)
+            names = [column.name for column in columns]
+            # the keys are needed to seek the next batch
+            columns += [get_column(Model, f) for f, _ in keys if f not in names]
+        seek: dict = {}
+        while True:
+            select_batch = self.select_page(
+                Model, query, 0, batch_size, keys, seek, columns
+            )
+            rows = await self.run(self.limit_time(select_batch, max_time_ms))
+            for row in rows:
+                yield row
+            if len(rows) < batch_size:
+                break
+            seek = keyset_filter(keys, [rows[-1][field] for field, _ in keys])
+
+    def limit_time(
+        self, func: Callable[[Session], T], max_time_ms: Optional[int]
+    ) -> Callable[[Session], T]:
+        """Wrap func so its statements are cancelled after max_time_ms
+        (postgresql statement_timeout and mysql max_execution_time) and
+        QueryTimeout is raised. Other dialects run func without a limit.
+        """
+        dialect = self.engine.dialect.name
+        if not max_time_ms or dialect not in ("postgresql", "mysql"):
+            return func
+        timeout = int(max_time_ms)
+
+        def limited(session: Session) -> T:
+            if dialect == "postgresql":
+                # only for the current transaction
+                session.execute(text(f"SET LOCAL statement_timeout = {timeout}"))
+            else:
+                session.execute(text(f"SET max_execution_time = {timeout}"))
+            try:
+                return func(session)
+            except DBAPIError as e:
+                code = getattr(e.orig, "pgcode", None) or getattr(
+                    e.orig, "sqlstate", None
+                )
+                if code == "57014" or (e.orig.args and e.orig.args[0] == 3024):
+                    raise QueryTimeout(e)
+                raise e
+            finally:
+                if dialect == "mysql":
+                    session.execute(text("SET max_execution_time = 0"))
 
-    async def find_one(self, resource: Resource, query: dict) -> Optional[dict]:
+        return limited
+
+    async def count_exact(
+        self, resource: Resource, query: dict, max_time_ms: Optional[int] = None
+    ) -> int:
+        Model = self.get_model(resource)
+
+        def count_exact(session: Session) -> int:
+            statement = select([func.count()]).select_from(Model)
+            return int(
+                session.exec(statement.where(*where_clause(Model, query))).one()  # type: ignore
+            )
+
+        return await self.run(self.limit_time(count_exact, max_time_ms))
+
+    async def count_estimated(self, resource: Resource) -> int:
+        """Row count from the table statistics (postgresql and mysql)"""
+        Model = self.get_model(resource)
+        table_name = Model.__tablename__  # type: ignore
+        dialect = self.engine.dialect.name
+        if dialect == "postgresql":
+            statement = text(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:t)"
+            )
+        elif dialect == "mysql":
+            statement = text(
+                "SELECT table_rows FROM information_schema.tables "
+                "WHERE table_schema = DATABASE() AND table_name = :t"
+            )
+        else:
+            return await self.count_exact(resource, {})
+
+        def count_estimated(session: Session) -> Optional[int]:
+            return session.execute(statement, {"t": table_name}).scalar()
+
+        count = await self.run(count_estimated)
+        if count is None or count < 0:
+            # table has not been analysed yet
+            return await self.count_exact(resource, {})
+        return int(count)
+
+    async def find_one(
+        self, resource: Resource, query: dict, projection: Optional[dict] = None
+    ) -> Optional[dict]:
         """"""
         Model = self.get_model(resource)
-        with Session(self.engine) as session:
-            where = [getattr(Model, key) == value for key, value in query.items()]
+        columns = projection_columns(Model, projection) if projection else None
+
+        def find_one(session: Session) -> Optional[dict]:
+            where = where_clause(Model, query)
+            if columns:
+                statement = select_columns(*columns).where(*where)
+                row = session.execute(statement).first()
+                return dict(row._mapping) if row else None
             model = session.exec(select(Model).where(*where)).first()  # type: ignore
-        if model:
-            return model.dict()
-        return None
+            if model:
+                return model.dict()
+            return None
+
+        return await self.run(find_one)
+
+    async def find_list_of_ids(
+        self, resource: Resource, ids: List, projection: Optional[dict] = None
+    ) -> List[dict]:
+        """"""
+        Model = self.get_model(resource)
+        query = {Model.get_primary_key(): {"$in": ids}}
+        columns = projection_columns(Model, projection) if projection else None
+        return await self.run(
+            self.select_page(Model, query, 0, len(ids), None, None, columns)
+        )
 
     @log
     async def create(self, resource: Resource, payload: dict) -> SQLModel:
@@ -64,61 +417,122 @@ class SQLDataLayer(DataLayer):
         Model = self.get_model(resource)
         model = Model(**payload)
 
-        with Session(self.engine) as session:
+        def create(session: Session) -> SQLModel:
             session.add(model)
             session.commit()
             session.refresh(model)
             return model
 
+        return await self.write(resource, create)
+
     async def create_many(self, resource: Resource, payload: List[dict]) -> List[dict]:
-        """"""
+        """Bulk insert with Core INSERT statements of up to SQL_BULK_CHUNK_SIZE
+        rows. Dialects that support it (postgresql) use a multi row
+        INSERT ... RETURNING, rows with known primary keys use executemany,
+        otherwise the new primary keys are fetched row by row without
+        refreshing each model.
+        """
         Model = self.get_model(resource)
-        models = [Model(**data) for data in payload]
-        with Session(self.engine) as session:
-            session.add_all(models)
+        table = Model.__table__  # type: ignore
+        pk = Model.get_primary_key()
+        rows = []
+        for data in payload:
+            row = Model(**data).dict()  # apply model defaults
+            if row.get(pk) is None:
+                row.pop(pk, None)  # generated by the database
+            rows.append(row)
+        chunk_size = self.app.config.SQL_BULK_CHUNK_SIZE
+        full_returning = getattr(self.engine.dialect, "full_returning", False)
+
+        def create_many(session: Session) -> List[dict]:
+            documents: List[dict] = []
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start : start + chunk_size]
+                # a multi row insert needs the same columns in every row
+                for columns, group in groupby(chunk, key=lambda row: tuple(row)):
+                    rows_ = list(group)
+                    if full_returning:
+                        statement = insert(table).values(rows_).returning(*table.c)
+                        result = session.execute(statement)
+                        documents += [dict(row._mapping) for row in result]
+                    elif pk in columns:
+                        session.execute(insert(table), rows_)
+                        documents += rows_
+                    else:
+                        session.bulk_insert_mappings(Model, rows_, return_defaults=True)  # type: ignore
+                        documents += rows_
             session.commit()
-            for model in models:
-                session.refresh(model)
-        return [model.dict() for model in models]
+            return documents
+
+        return await self.write(resource, create_many)
 
     async def remove(self, resource: Resource) -> None:
         """Removes an entire set of documents from a
         database Model.
         """
         Model = self.get_model(resource)
-        with Session(self.engine) as session:
+
+        def remove(session: Session) -> None:
             session.exec(delete(Model))  # type: ignore
             session.commit()
 
-    async def remove_item(self, resource: Resource, query: dict) -> None:
-        """Removes a single document from a database collection."""
+        await self.write(resource, remove)
+
+    async def remove_item(self, resource: Resource, query: dict) -> int:
+        """Removes a single document from a database collection.
+        Returns the number of rows removed.
+        """
         Model = self.get_model(resource)
-        with Session(self.engine) as session:
-            where = [getattr(Model, key) == value for key, value in query.items()]
-            model = session.exec(select(Model).where(*where)).first()  # type: ignore
-            session.delete(model)
+        statement = delete(Model).where(*where_clause(Model, query))
+
+        def remove_item(session: Session) -> int:
+            result = session.execute(
+                statement.execution_options(synchronize_session=False)
+            )
             session.commit()
+            return result.rowcount  # type: ignore
+
+        return await self.write(resource, remove_item)
 
     async def replace_item(
-        self, resource: Resource, query: dict, payload: dict
-    ) -> None:
-        """Replaces single document from a database collection"""
+        self, resource: Resource, query: dict, payload: dict, upsert: bool = False
+    ) -> int:
+        """Replaces single document from a database collection. With upsert
+        the item is inserted (in the same transaction) when nothing matches.
+        Returns the number of rows matched.
+        """
         Model = self.get_model(resource)
-        with Session(self.engine) as session:
-            where = [getattr(Model, key) == value for key, value in query.items()]
-            model = session.exec(select(Model).where(*where)).first()  # type: ignore
-            for key, value in payload.items():
-                setattr(model, key, value)
-            session.add(model)
+
+        def replace_item(session: Session) -> int:
+            matched = self._update(session, Model, query, payload)
+            if not matched and upsert:
+                session.add(Model(**{**payload, **query}))
             session.commit()
+            return matched
+
+        return await self.write(resource, replace_item)
 
-    async def update_item(self, resource: Resource, query: dict, payload: dict) -> None:
-        """Updates single document from a database collection"""
+    async def update_item(self, resource: Resource, query: dict, payload: dict) -> int:
+        """Updates single document from a database collection with a single
+        UPDATE statement. Returns the number of rows matched.
+        """
         Model = self.get_model(resource)
-        with Session(self.engine) as session:
-            where = [getattr(Model, key) == value for key, value in query.items()]
-            model = session.exec(select(Model).where(*where)).first()  # type: ignore
-            for key, value in payload.items():
-                setattr(model, key, value)
-            session.add(model)
+
+        def update_item(session: Session) -> int:
+            matched = self._update(session, Model, query, payload)
             session.commit()
+            return matched
+
+        return await self.write(resource, update_item)
+
+    def _update(
+        self, session: Session, Model: Type[SQLModel], query: dict, payload: dict
+    ) -> int:
+        where = where_clause(Model, query)
+        if not payload:
+            # nothing to set, only check the item exists
+            count = select([func.count()]).select_from(Model).where(*where)
+            return min(int(session.exec(count).one()), 1)  # type: ignore
+        statement = update(Model).where(*where).values(**payload)
+        result = session.execute(statement.execution_options(synchronize_session=False))
+        return result.rowcount  # type: ignore
@@ -0,0 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool, StaticPool
+from typing import Any, Callable, Optional, TypeVar
+import asyncio
+import os
+import threading
+import time
+
+T = TypeVar("T")
+
+
+def engine_pool_size(engine: Engine) -> int:
+    """Max number of connections the engine pool will hand out"""
+    pool = engine.pool
+    if isinstance(pool, QueuePool):
+        return pool.size() + max(pool._max_overflow, 0)  # type: ignore
+    if isinstance(pool, StaticPool):
+        return 1
+    # NullPool does not limit connections (ThreadPoolExecutor default size)
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+class ThreadPool:
+    """Bounded thread pool used to run blocking Session operations off the
+    event loop. Keeps counters so saturation can be monitored e.g.
+    queued > 0 for long periods means the pool (or the engine) is too small.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.queued = 0  # submitted and waiting for a thread
+        self.active = 0  # running in a thread
+        self.completed = 0
+        self.wait_time = 0.0  # total seconds spent queued
+        self.max_wait_time = 0.0
+
+    def start(self) -> None:
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.size, thread_name_prefix="fasteve-sql"
+            )
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        self.start()
+        submitted = time.monotonic()
+        with self._lock:
+            self.queued += 1
+
+        def call() -> T:
+            wait = time.monotonic() - submitted
+            with self._lock:
+                self.queued -= 1
+                self.active += 1
+                self.wait_time += wait
+                self.max_wait_time = max(self.max_wait_time, wait)
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, call)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "queued": self.queued,
+                "active": self.active,
+                "completed": self.completed,
+                "wait_time": self.wait_time,
+                "max_wait_time": self.max_wait_time,
+            }
@@ -0,0 +1,88 @@
+from sqlalchemy import and_, or_, true
+from sqlalchemy.sql.elements import ColumnElement
+from fasteve.core.query import InvalidQuery
+from fasteve.model import SQLModel
+from typing import Any, Callable, Dict, List, Tuple, Type
+
+OPERATORS: Dict[str, Callable[[Any, Any], ColumnElement]] = {
+    "$eq": lambda column, value: column == value,
+    "$ne": lambda column, value: column != value,
+    "$gt": lambda column, value: column > value,
+    "$gte": lambda column, value: column >= value,
+    "$lt": lambda column, value: column < value,
+    "$lte": lambda column, value: column <= value,
+    "$in": lambda column, value: column.in_(value),
+    "$nin": lambda column, value: column.notin_(value),
+}
+
+
+def get_column(Model: Type[SQLModel], field: str) -> Any:
+    try:
+        return Model.__table__.columns[field]  # type: ignore
+    except KeyError:
+        raise InvalidQuery(f"field '{field}' is not valid")
+
+
+def all_of(clauses: List[ColumnElement]) -> ColumnElement:
+    return and_(*clauses) if clauses else true()
+
+
+def where_clause(Model: Type[SQLModel], query: dict) -> List[ColumnElement]:
+    """Compile a mongo style filter (see fasteve.core.query.parse_where)
+    into a list of SQLAlchemy WHERE clauses.
+    """
+    clauses: List[ColumnElement] = []
+    for key, value in query.items():
+        if key == "$and":
+            clauses.append(and_(*[all_of(where_clause(Model, q)) for q in value]))
+        elif key == "$or":
+            clauses.append(or_(*[all_of(where_clause(Model, q)) for q in value]))
+        else:
+            column = get_column(Model, key)
+            if isinstance(value, dict):
+                for operator, operand in value.items():
+                    clauses.append(OPERATORS[operator](column, operand))
+            else:
+                clauses.append(column == value)
+    return clauses
+
+
+def order_by_clause(
+    Model: Type[SQLModel], sort: List[Tuple[str, int]], nulls_largest: bool = False
+) -> List[ColumnElement]:
+    """ORDER BY with nulls first ascending and last descending (see
+    fasteve.core.query.keyset_filter). Dialects that sort nulls as the
+    largest value (postgresql) need it explicitly.
+    """
+    clauses = []
+    for field, direction in sort:
+        column = get_column(Model, field)
+        if direction < 0:
+            clauses.append(
+                column.desc().nulls_last() if nulls_largest else column.desc()
+            )
+        else:
+            clauses.append(
+                column.asc().nulls_first() if nulls_largest else column.asc()
+            )
+    return clauses
+
+
+def projection_columns(Model: Type[SQLModel], projection: dict) -> List[Any]:
+    """Columns selected by a projection (see fasteve.core.query.parse_projection)"""
+    pk = Model.get_primary_key()
+    for field in projection:
+        get_column(Model, field)
+    columns = Model.__table__.columns  # type: ignore
+    if any(projection.values()):
+        selected = [
+            column
+            for column in columns
+            if projection.get(column.name)
+            or (column.name == pk and pk not in projection)
+        ]
+    else:
+        selected = [column for column in columns if column.name not in projection]
+    if not selected:
+        raise InvalidQuery("projection excludes every field")
+    return selected
@@ -3,3 +3,5 @@ from .post import post
 from .patch import patch_item
 from .put import put_item
 from .delete import delete, delete_item
+from .export import export
+from .ingest import ingest
@@ -3,26 +3,91 @@ from fasteve.core.utils import (
     InvalidMongoObjectId,
     MongoObjectId,
 )
-from typing import Union
+from typing import Dict, List, Optional, Tuple, Union
 from sqlmodel.main import SQLModelMetaclass
+from fasteve.core.cache import cache_key
+from fasteve.resource import Resource
+import asyncio
+import copy
 
 
-async def get_item_internal(
-    request: Request, item_id: Union[MongoObjectId, int, str]
-) -> dict:
+def item_query(request: Request, item_id: Union[MongoObjectId, int, str]) -> dict:
+    """Lookup for a single item by primary key (or alt_id)"""
     pk = request.state.resource.model.get_primary_key()
     if type(request.state.resource.model) == SQLModelMetaclass:
         query = {pk: item_id}
     else:
         try:
-            query = {pk: MongoObjectId.validate(item_id)}
+            query = {pk: MongoObjectId.validate(item_id)}  # type: ignore
         except InvalidMongoObjectId as e:
             # item_id is not a valid MongoObjectId check if there is an alt_id set
             if not request.state.resource.alt_id:
                 raise e
             query = {request.state.resource.alt_id: item_id}
+    return query
+
+
+async def get_item_internal(
+    request: Request,
+    item_id: Union[MongoObjectId, int, str],
+    projection: Optional[dict] = None,
+) -> dict:
+    query = item_query(request, item_id)
+    resource = request.state.resource
+    if resource.item_cache:
+        # by lookup (primary key or alt_id) and projection
+        cache = request.app.data.get_item_cache(resource)
+        key = cache_key([query, projection])
+        document = cache.get(key)
+        if document is not None:
+            return copy.deepcopy(document)
+        generation = cache.generation
     try:
-        document = await request.app.data.find_one(request.state.resource, query)
+        document = await request.app.data.find_one(resource, query, projection)
     except Exception as e:
         raise e
+    if document and resource.item_cache:
+        cache.set(key, copy.deepcopy(document), generation)
     return document
+
+
+async def embed_documents(
+    request: Request,
+    documents: List[dict],
+    relations: Dict[str, Tuple[Resource, bool]],
+) -> List[dict]:
+    """Replace data relation ids with the related items (?embedded=).
+    relations maps field names to the related resource and whether the
+    field is a list of ids. Every relation is fetched once for the whole
+    page (by primary key) and the relations are fetched concurrently.
+    """
+
+    async def embed(field_name: str, relation: Resource, many: bool) -> None:
+        ids: dict = {}  # ordered set
+        for document in documents:
+            value = document.get(field_name)
+            for item_id in (value or []) if many else [value]:
+                if item_id is not None:
+                    ids[item_id] = None
+        if not ids:
+            return
+        pk = relation.model.get_primary_key()  # type: ignore
+        items = await request.app.data.find_list_of_ids(relation, list(ids))
+        items_by_id = {item[pk]: item for item in items}
+        for document in documents:
+            value = document.get(field_name)
+            if many and value:
+                # like $lookup, missing items are left out
+                document[field_name] = [
+                    items_by_id[item_id] for item_id in value if item_id in items_by_id
+                ]
+            elif value is not None:
+                document[field_name] = items_by_id.get(value, value)
+
+    await asyncio.gather(
+        *[
+            embed(field_name, relation, many)
+            for field_name, (relation, many) in relations.items()
+        ]
+    )
+    return documents
@@ -3,7 +3,7 @@ from fasteve.core.utils import (
     MongoObjectId,
 )
 from typing import Union
-from fasteve.methods.common import get_item_internal
+from fasteve.methods.common import item_query
 from fastapi import HTTPException
 from fastapi import Response
 
@@ -19,15 +19,11 @@ async def delete(request: Request) -> Response:
 async def delete_item(
     request: Request, item_id: Union[MongoObjectId, int, str]
 ) -> Response:
-    item = await get_item_internal(request, item_id)
-    if not item:
-        raise HTTPException(404)
-    pk = request.state.resource.model.get_primary_key()
-    if pk == "_id":
-        MongoObjectId.validate(item_id)
-    query = {pk: item_id}
+    query = item_query(request, item_id)
     try:
-        await request.app.data.remove_item(request.state.resource, query)
+        removed = await request.app.data.remove_item(request.state.resource, query)
     except Exception as e:
         raise e
+    if not removed:
+        raise HTTPException(404)
     return Response(status_code=204)
@@ -0,0 +1,73 @@
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+from datetime import date, datetime, time
+from typing import Any, AsyncIterator
+import json
+
+from fasteve.core.query import InvalidQuery
+from fasteve.io.base import QueryTimeout
+from fasteve.methods.get import get_projection, get_sort, get_where, invalid_query
+
+CHUNK_SIZE = 64 * 1024  # bytes per write
+
+
+def json_default(value: Any) -> Any:
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    return str(value)  # ObjectId, Decimal, UUID...
+
+
+async def export(request: Request) -> StreamingResponse:
+    """Stream every (optionally filtered) item of the resource as NDJSON.
+
+    Items come from DataLayer.find_stream so only one batch is held in
+    memory. The response is written in chunks and each write waits for the
+    client, so a slow client slows down the export instead of buffering it.
+
+    Unindexed filters run within the resource slow_query_budget. The first
+    batch is read before the response starts so a timeout there is a 422,
+    a later one ends the stream.
+    """
+    resource = request.state.resource
+    where, max_time_ms = get_where(request, resource)
+    sort = get_sort(request, resource)
+    projection = get_projection(request, resource)
+    documents = request.app.data.find_stream(
+        resource,
+        query=where,
+        sort=sort,
+        projection=projection,
+        batch_size=request.app.config.EXPORT_BATCH_SIZE,
+        max_time_ms=max_time_ms,
+    )
+    try:
+        first = [await documents.__anext__()]
+    except StopAsyncIteration:
+        first = []
+    except QueryTimeout:
+        raise invalid_query(
+            request.app.config.QUERY_WHERE,
+            InvalidQuery("query exceeded the slow query budget"),
+        )
+
+    async def all_documents() -> AsyncIterator[dict]:
+        for document in first:
+            yield document
+        async for document in documents:
+            yield document
+
+    async def lines() -> AsyncIterator[bytes]:
+        chunk = []
+        size = 0
+        async for document in all_documents():
+            line = json.dumps(document, default=json_default) + "\n"
+            chunk.append(line)
+            size += len(line)
+            if size >= CHUNK_SIZE:
+                yield "".join(chunk).encode("utf-8")
+                chunk = []
+                size = 0
+        if chunk:
+            yield "".join(chunk).encode("utf-8")
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
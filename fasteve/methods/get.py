@@ -4,12 +4,144 @@ from fasteve.core.utils import (
     log,
     MongoObjectId,
 )
+from fasteve.core.query import (
+    LOGICAL_OPERATORS,
+    InvalidQuery,
+    decode_cursor,
+    encode_cursor,
+    keyset_filter,
+    parse_projection,
+    parse_sort,
+    parse_where,
+    query_fields,
+)
+from fasteve.io.base import QueryTimeout
 from math import ceil
 from fastapi import HTTPException
-from typing import Union
+from typing import Any, List, Optional, Tuple, Union
+from urllib.parse import urlencode
 import json
 
-from fasteve.methods.common import get_item_internal
+from fasteve.methods.common import embed_documents, get_item_internal
+from fasteve.resource import Resource
+
+
+def invalid_query(param: str, error: InvalidQuery) -> HTTPException:
+    detail = [
+        {
+            "loc": ["query", param],
+            "msg": str(error),
+            "type": "value_error.invalid_query",
+        }
+    ]
+    return HTTPException(422, detail)
+
+
+def get_where(request: Request, resource: Resource) -> Tuple[dict, Optional[int]]:
+    """Parse the where query parameter, coerce its values to the model field
+    types and check it against the resource allowed_filters and
+    index_policy. Returns the filter and the time limit to run it with
+    (resource.slow_query_budget if it is not indexed).
+    """
+    param = request.app.config.QUERY_WHERE
+    if not request.query_params.get(param):
+        return {}, None
+    max_time_ms = None
+    try:
+        where = coerce_where(resource, parse_where(request.query_params[param]))
+        if request.app.data.indexes.check_filter(resource, query_fields(where)):
+            # unindexed filter, run it within the budget
+            max_time_ms = resource.slow_query_budget
+    except InvalidQuery as e:
+        raise invalid_query(param, e)
+    return where, max_time_ms
+
+
+def field_names(resource: Resource) -> List[str]:
+    """Fields that can be queried, the response fields and the primary key
+    (which mongo models don't have to declare)
+    """
+    fields = [field.alias for field in resource.response_model.__fields__.values()]  # type: ignore
+    pk = resource.model.get_primary_key()  # type: ignore
+    return fields if pk in fields else fields + [pk]
+
+
+def get_projection(request: Request, resource: Resource) -> Optional[dict]:
+    """Parse the projection query parameter (if the resource allows it)"""
+    param = request.app.config.QUERY_PROJECTION
+    if not resource.projection or not request.query_params.get(param):
+        return None
+    try:
+        projection = parse_projection(
+            request.query_params[param], resource.model.get_primary_key()  # type: ignore
+        )
+        fields = field_names(resource)
+        for field in projection:
+            if field not in fields:
+                raise InvalidQuery(f"field '{field}' is not valid")
+    except InvalidQuery as e:
+        raise invalid_query(param, e)
+    return projection or None
+
+
+def get_sort(request: Request, resource: Resource) -> Optional[List[Tuple[str, int]]]:
+    """Parse the sort query parameter (if the resource allows it) and check
+    it against the resource index_policy
+    """
+    param = request.app.config.QUERY_SORT
+    if not resource.sorting or not request.query_params.get(param):
+        return None
+    try:
+        sort = parse_sort(request.query_params[param])
+        fields = field_names(resource)
+        for field, _ in sort:
+            if field not in fields:
+                raise InvalidQuery(f"field '{field}' is not valid")
+        request.app.data.indexes.check_sort(resource, sort)
+    except InvalidQuery as e:
+        raise invalid_query(param, e)
+    return sort
+
+
+def validate_field(resource: Resource, field: str, value: Any) -> Any:
+    """Validate a query value with the model field type (e.g. str -> ObjectId)"""
+    fields = {f.alias: f for f in resource.model.__fields__.values()}  # type: ignore
+    if field not in fields and field == resource.model.get_primary_key():  # type: ignore
+        # undeclared mongo _id (sql primary keys are always declared)
+        try:
+            return MongoObjectId.validate(value)
+        except InvalidMongoObjectId:
+            raise InvalidQuery(f"field '{field}' is not valid")
+    if field not in fields:
+        if field.split(".")[0] in fields:
+            return value  # sub document
+        raise InvalidQuery(f"field '{field}' is not valid")
+    if value is None:
+        return value
+    value, error = fields[field].validate(value, {}, loc=field)
+    if error:
+        raise InvalidQuery(f"field '{field}' is not valid")
+    return value
+
+
+def coerce_where(resource: Resource, query: dict) -> dict:
+    """Validate the values of a where filter with the model field types so
+    they match the stored values (and indexes) e.g. str -> ObjectId/datetime
+    """
+    coerced: dict = {}
+    for key, value in query.items():
+        if key in LOGICAL_OPERATORS:
+            coerced[key] = [coerce_where(resource, q) for q in value]
+        elif isinstance(value, dict):
+            coerced[key] = {
+                operator: [validate_field(resource, key, v) for v in operand]
+                if operator in ("$in", "$nin")
+                else validate_field(resource, key, operand)
+                for operator, operand in value.items()
+            }
+        else:
+            coerced[key] = validate_field(resource, key, value)
+    return coerced
 
 
 @log
@@ -17,12 +149,8 @@ async def get(request: Request) -> dict:
     resource = request.state.resource
     query_params = dict(request.query_params)
     path_params = dict(request.path_params)
-    limit = int(query_params["max_results"]) if "max_results" in query_params else 25
-    page = int(query_params["page"]) if "page" in query_params else 1
-    skip = (page - 1) * limit if page > 1 else 0
 
     query = {}
-    pipeline = []
 
     item_id = (
         path_params[f"{resource.item_name}_id"]
@@ -45,21 +173,23 @@ async def get(request: Request) -> dict:
         try:
             query[sub_resource.id_field] = MongoObjectId.validate(item_id)
         except InvalidMongoObjectId:
-            lookup = {}
-            lookup["from"] = resource.name
-            lookup["localField"] = sub_resource.id_field
-            lookup["foreignField"] = "_id"
-            lookup["as"] = sub_resource.id_field
-            pipeline.append({"$lookup": lookup})
-            pipeline.append({"$unwind": "$" + sub_resource.id_field})
-            pipeline.append(
-                {"$match": {f"{sub_resource.id_field}.{resource.alt_id}": item_id}}
-            )
-            pipeline.append(
-                {"$addFields": {sub_resource.id_field: f"${sub_resource.id_field}._id"}}
-            )
+            # resolve the parent alt_id to its id (an indexed, cached lookup)
+            # so the sub resource query is an equality match on id_field
+            parent_id = None
+            if resource.alt_id:
+                parent_id = await request.app.data.resolve_alt_id(resource, item_id)
+            if parent_id is None:
+                raise HTTPException(404)
+            query[sub_resource.id_field] = parent_id
 
         resource = sub_resource.resource
+    limit = int(query_params["max_results"]) if "max_results" in query_params else 25
+    # clamp to the cap, 0 would otherwise mean no limit
+    cap = resource.max_results_cap or request.app.config.MAX_RESULTS_CAP
+    limit = min(max(limit, 1), cap)
+    page = int(query_params["page"]) if "page" in query_params else 1
+    skip = (page - 1) * limit if page > 1 else 0
+
     try:
         if "embedded" in query_params and query_params["embedded"]:
             embedded = json.loads(query_params["embedded"])
@@ -75,8 +205,10 @@ async def get(request: Request) -> dict:
         ]
         raise HTTPException(422, detail)
 
+    # data relations to embed, resolved after the find
+    relations = {}
     for field_name in embedded:
-        if not embedded[field_name]:
+        if not embedded[field_name] or not resource.embedding:
             continue
         try:
             field = resource.response_model.__fields__[field_name]
@@ -90,7 +222,7 @@ async def get(request: Request) -> dict:
             ]
             raise HTTPException(422, detail)
         try:
-            field.field_info.extra["data_relation"]
+            relation = field.field_info.extra["data_relation"]
         except:
             detail = [
                 {
@@ -100,59 +232,150 @@ async def get(request: Request) -> dict:
                 }
             ]
             raise HTTPException(422, detail)
-        lookup = {}
-        lookup["from"] = field_name
-        lookup["localField"] = field_name
-        lookup["foreignField"] = "_id"
-        lookup["as"] = field_name
-        stage = {"$lookup": lookup}
-        pipeline.append(stage)  # assumes valid
-        if not field.field_info.extra["many"]:
-            pipeline.append({"$unwind": "$" + field_name})
-    if pipeline:
-        documents, count = await request.app.data.aggregate(
-            resource, pipline=pipeline, skip=skip, limit=limit
+        relations[field_name] = (relation, field.field_info.extra["many"])
+
+    where, max_time_ms = get_where(request, resource)
+    query = request.app.data.combine_queries(query, where)
+
+    projection = get_projection(request, resource)
+
+    sort = get_sort(request, resource)
+    seek = {}
+    fetch = limit
+    if resource.cursor_pagination or resource.count == "none":
+        fetch = limit + 1  # one extra to check for a next page without counting
+    if resource.cursor_pagination:
+        # keyset pagination, seek past the sort keys of the previous page
+        # (the primary key breaks ties)
+        pk = resource.model.get_primary_key()
+        sort = sort or []
+        if pk not in [field for field, _ in sort]:
+            sort.append((pk, 1))
+        skip = 0
+        cursor = query_params.get(request.app.config.QUERY_CURSOR)
+        if cursor:
+            try:
+                values = decode_cursor(cursor)
+                if len(values) != len(sort):
+                    raise InvalidQuery("value is not a valid cursor")
+                values = [
+                    validate_field(resource, field, value)
+                    for (field, _), value in zip(sort, values)
+                ]
+            except InvalidQuery:
+                raise invalid_query(
+                    request.app.config.QUERY_CURSOR,
+                    InvalidQuery("value is not a valid cursor"),
+                )
+            seek = keyset_filter(sort, values)
+        if projection:
+            # the cursor is made from the sort keys
+            for field, _ in sort:
+                if any(projection.values()):
+                    projection[field] = 1
+                else:
+                    projection.pop(field, None)
+            projection = projection or None
+
+    try:
+        documents, count = await request.app.data.find(
+            resource,
+            query=query,
+            skip=skip,
+            limit=fetch,
+            sort=sort,
+            seek=seek,
+            projection=projection,
+            max_time_ms=max_time_ms,
+        )
+    except InvalidQuery as e:
+        raise invalid_query(request.app.config.QUERY_WHERE, e)
+    except QueryTimeout:
+        raise invalid_query(
+            request.app.config.QUERY_WHERE,
+            InvalidQuery("query exceeded the slow query budget"),
         )
+    except Exception as e:
+        raise e
+
+    if fetch != limit:
+        has_more = len(documents) > limit
+        documents = documents[:limit]
     else:
-        try:
-            documents, count = await request.app.data.find(
-                resource, query=query, skip=skip, limit=limit
-            )
-        except Exception as e:
-            raise e
+        has_more = count is not None and skip + len(documents) < count
+
+    next_cursor = None
+    if resource.cursor_pagination and has_more:
+        next_cursor = encode_cursor(
+            [documents[-1].get(field) for field, _ in sort or []]
+        )
+
+    if relations:
+        documents = await embed_documents(request, documents, relations)
+
     response = {}
 
     response[request.app.config.DATA] = documents
 
     if request.app.config.PAGINATION:
-        response[request.app.config.META] = {
-            "page": page,
-            "max_results": limit,
-            "total": count,
-        }  # _meta_links(req, count)
+        meta: dict = {"max_results": limit}
+        if not resource.cursor_pagination:
+            meta["page"] = page
+        if count is not None:
+            meta["total"] = count
+        else:
+            meta["has_more"] = has_more
+        if next_cursor:
+            meta["next"] = next_cursor
+        response[request.app.config.META] = meta  # _meta_links(req, count)
 
     if request.app.config.HATEOAS:
-        max_results = "&max_result=" + str(limit) if limit != 25 else ""
         response[request.app.config.LINKS] = {
             "self": {"href": request["path"], "title": resource.name},
             "parent": {"href": "/", "title": "home"},
         }  # _pagination_links(resource, req, count)
-        if count > limit:
+        if next_cursor:
+            params = dict(query_params)
+            params.pop("page", None)
+            params[request.app.config.QUERY_CURSOR] = next_cursor
             response[request.app.config.LINKS]["next"] = {
-                "href": f"{request['path']}?page={page + 1}{max_results}",
+                "href": f"{request['path']}?{urlencode(params)}",
                 "title": "next page",
             }
-            response[request.app.config.LINKS]["last"] = {
-                "href": f"{request['path']}?page={ceil(count / limit)}{max_results}",
-                "title": "last page",
+        elif has_more:
+            response[request.app.config.LINKS]["next"] = {
+                "href": page_link(request, query_params, page + 1, limit),
+                "title": "next page",
             }
+            if resource.count in ("exact", "cached") and count:
+                # an estimated total could point past the real last page
+                response[request.app.config.LINKS]["last"] = {
+                    "href": page_link(
+                        request, query_params, ceil(count / limit), limit
+                    ),
+                    "title": "last page",
+                }
     return response
 
 
+def page_link(request: Request, query_params: dict, page: int, limit: int) -> str:
+    """Link to another page of the same query (where, sort, projection...)"""
+    params: dict = {"page": page}
+    params.update(
+        (key, value)
+        for key, value in query_params.items()
+        if key not in ("page", "max_results")
+    )
+    if limit != 25:
+        params["max_results"] = limit
+    return f"{request['path']}?{urlencode(params)}"
+
+
 async def get_item(request: Request, item_id: Union[MongoObjectId, int, str]) -> dict:
 
+    projection = get_projection(request, request.state.resource)
     try:
-        item = await get_item_internal(request, item_id)
+        item = await get_item_internal(request, item_id, projection)
     except InvalidMongoObjectId as e:
         raise HTTPException(400, str(e))
 
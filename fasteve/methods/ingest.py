@@ -0,0 +1,131 @@
+from starlette.requests import Request
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+from typing import AsyncIterator, List, Optional
+import asyncio
+import json
+
+from fasteve.io.mongo.utils import render_pymongo_error
+
+MAX_REPORTED_ERRORS = 1000  # keep the report (and memory) bounded
+
+
+async def read_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Split a byte stream into lines without reading all of it"""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+class Report:
+    def __init__(self) -> None:
+        self.inserted = 0
+        self.error_count = 0
+        self.errors: List[dict] = []
+
+    def error(self, line: int, detail: list) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "detail": detail})
+
+    def dict(self) -> dict:
+        return {
+            "inserted": self.inserted,
+            "error_count": self.error_count,
+            "errors": self.errors,
+        }
+
+
+async def insert_batch(
+    request: Request, documents: List[dict], lines: List[int], report: Report
+) -> None:
+    resource = request.state.resource
+    await request.app.events.run("before_create_items", resource.name, documents)
+    try:
+        documents = await request.app.data.create_many(resource, documents)
+    except BulkWriteError as e:
+        # per document errors, the rest of the batch may have been inserted
+        report.inserted += e.details.get("nInserted", 0)
+        for error in e.details["writeErrors"]:
+            report.error(lines[error["index"]], [render_pymongo_error(error)])
+        return
+    except Exception as e:
+        detail = [{"loc": ["body"], "msg": str(e), "type": "value_error.database"}]
+        for line in lines:
+            report.error(line, detail)
+        return
+    report.inserted += len(documents)
+    response = {request.app.config.DATA: documents}
+    await request.app.events.run("after_create_items", resource.name, response)
+
+
+async def ingest(request: Request) -> dict:
+    """Insert the NDJSON request body (one item per line).
+
+    The body is read and validated line by line and inserted with
+    create_many in batches of IMPORT_BATCH_SIZE. The next batch is parsed
+    while the previous one is being inserted, so at most two batches are
+    held in memory. Invalid lines and failed inserts are reported by line
+    number instead of failing the request.
+    """
+    resource = request.state.resource
+    Model = resource.create_model
+    batch_size = request.app.config.IMPORT_BATCH_SIZE
+    report = Report()
+    documents: List[dict] = []
+    lines: List[int] = []
+    pending: Optional[asyncio.Task] = None
+
+    line_number = 0
+    try:
+        async for line in read_lines(request.stream()):
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                document = json.loads(line)
+            except ValueError:
+                detail = [
+                    {
+                        "loc": ["body"],
+                        "msg": "value is not valid JSON",
+                        "type": "value_error.json",
+                    }
+                ]
+                report.error(line_number, detail)
+                continue
+            if not isinstance(document, dict):
+                detail = [
+                    {
+                        "loc": ["body"],
+                        "msg": "value is not a valid dict",
+                        "type": "type_error.dict",
+                    }
+                ]
+                report.error(line_number, detail)
+                continue
+            try:
+                documents.append(Model.validate(document).dict())  # type: ignore
+            except ValidationError as e:
+                report.error(line_number, e.errors())
+                continue
+            lines.append(line_number)
+            if len(documents) >= batch_size:
+                if pending:
+                    await pending
+                pending = asyncio.create_task(
+                    insert_batch(request, documents, lines, report)
+                )
+                documents, lines = [], []
+    finally:
+        # never leave the previous batch running
+        if pending:
+            await pending
+    if documents:
+        await insert_batch(request, documents, lines, report)
+    return report.dict()
@@ -1,42 +1,57 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
-from starlette.types import ASGIApp
-from typing import Callable, List
+from starlette.datastructures import MutableHeaders
 from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import Dict, List
 from ..resource import Resource
 
 
-class ResourceMiddleware(BaseHTTPMiddleware):
-    app: ASGIApp
+class ResourceMiddleware:
+    """Sets request.state.resource and runs the before_/after_ request
+    events. Pure ASGI so responses (and streaming bodies) are passed through
+    untouched.
+    """
 
     def __init__(self, app: ASGIApp, resources: List[Resource]) -> None:
-        self.app = app  # type: ignore
-        self.dispatch_func = self.dispatch
-        self.resources = resources
-
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        if request.scope["path"] != "/":
-            # Use pattern matching to find resource
-            route = request.scope["path"][1:].split("/")[0]
-            resource = next(
-                (
-                    resource
-                    for resource in self.resources
-                    if resource.name is not None
-                    and resource.name.lower() == route.lower()
-                ),
-                None,
-            )
-        else:
-            resource = None
-        request.state.resource = resource
-        if resource:
-            await request.app.events.run(
-                f"before_{request.method}", resource.name, request
-            )
-        response = await call_next(request)
-        if resource:
-            await request.app.events.run(
-                f"after_{request.method}", resource.name, request, response
-            )
-        return response
+        self.app = app
+        self.resources: Dict[str, Resource] = {
+            resource.name.lower(): resource for resource in resources if resource.name
+        }
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = scope["path"][1:].split("/", 1)[0]
+        resource = self.resources.get(route.lower()) if route else None
+        scope.setdefault("state", {})["resource"] = resource
+        if not resource:
+            await self.app(scope, receive, send)
+            return
+
+        events = scope["app"].events
+        method = scope["method"]
+        before = f"before_{method}"
+        after = f"after_{method}"
+        if events.has_callbacks(before, resource.name):
+            request = Request(scope, receive)
+            await events.run(before, resource.name, request)
+        if not events.has_callbacks(after, resource.name):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_after(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                # the after events get the response (status and headers) before
+                # it is sent
+                response = Response(status_code=message["status"])
+                response.raw_headers = list(message.get("headers", []))
+                await events.run(
+                    after, resource.name, Request(scope, receive), response  # type: ignore
+                )
+                message["status"] = response.status_code
+                message["headers"] = MutableHeaders(raw=response.raw_headers).raw
+            await send(message)
+
+        await self.app(scope, receive, send_after)
@@ -34,6 +34,8 @@ class MetaModel(PydanticBaseModel):
     page: Optional[int]
     max_results: Optional[int]
     total: Optional[int]
+    has_more: Optional[bool]
+    next: Optional[str]
 
 
 class LinkModel(PydanticBaseModel):
@@ -1,9 +1,30 @@
 from __future__ import annotations
 from dataclasses import dataclass, field
-from typing import List, Optional, Union
+from typing import List, Optional, Tuple, Union
 from fasteve.model import SQLModel, MongoModel
 
 
+@dataclass
+class Index:
+    """Index declared on a resource e.g.
+    Index(["name", ("age", -1)], unique=True)
+    """
+
+    fields: List[Union[str, Tuple[str, int]]]  # field or (field, 1 or -1)
+    unique: bool = False
+    sparse: bool = False  # mongo only
+    ttl: Optional[int] = None  # expire documents after seconds, mongo only
+    partial: Optional[dict] = None  # where style filter of the rows to index
+    name: Optional[str] = None  # the data layer names it by default
+
+    def __post_init__(self) -> None:
+        if not self.fields:
+            raise ValueError("Index needs at least one field")
+        self.fields = [
+            (field, 1) if isinstance(field, str) else field for field in self.fields
+        ]
+
+
 @dataclass
 class Resource:
     model: Union[MongoModel, SQLModel]  # in the db
@@ -17,17 +38,41 @@ class Resource:
     alt_id: Optional[str] = None
     sub_resources: List[SubResource] = field(default_factory=lambda: list())
 
-    allowed_filters: bool = True
+    allowed_filters: Union[bool, List[str]] = True  # fields, True/"*" for all
     projection: bool = True
     sorting: bool = True
     embedding: bool = True
     datasource: Optional[dict] = None
     bulk_create: bool = True
+    bulk_ordered: bool = True  # False lets a bulk insert continue past errors
+    bulk_chunk_size: Optional[int] = None  # max documents per insert_many
+    write_concern: Optional[dict] = None  # e.g. {"w": 1, "j": False}
+    export: bool = False  # GET /{resource}/_export streams every item as NDJSON
+    bulk_import: bool = False  # POST /{resource}/_import ingests NDJSON
+    max_results_cap: Optional[int] = None  # defaults to config.MAX_RESULTS_CAP
+    cursor_pagination: bool = False  # keyset pagination with ?cursor= tokens
+    count: str = "exact"  # exact, estimated, cached or none
+    count_cache_ttl: float = 60  # seconds, used when count is "cached"
+    item_cache: int = 0  # max items cached for item GETs, 0 disables it
+    item_cache_ttl: float = 60  # seconds an item stays cached (writes clear it)
+    indexes: List[Index] = field(default_factory=lambda: list())
+    index_policy: str = "allow"  # allow, warn or reject queries no index covers
+    slow_query_budget: Optional[int] = None  # ms, time limit of unindexed filters
 
     def __post_init__(self) -> None:
         if not self.name:
             self.name = self.model.__name__.lower()  # type: ignore
 
+        if self.count not in ("exact", "estimated", "cached", "none"):
+            raise ValueError(
+                f"Invalid count '{self.count}' (exact, estimated, cached or none)"
+            )
+
+        if self.index_policy not in ("allow", "warn", "reject"):
+            raise ValueError(
+                f"Invalid index_policy '{self.index_policy}' (allow, warn or reject)"
+            )
+
         if not self.item_name:
             if self.name.endswith("s"):
                 self.item_name = self.name[:-1]
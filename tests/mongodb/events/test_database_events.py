@@ -2,6 +2,7 @@ from typing import Optional
 from fasteve import Fasteve, MongoModel, Resource, MongoObjectId
 from starlette.testclient import TestClient
 from pydantic import Field
+import pytest
 
 
 class People(MongoModel):
@@ -43,3 +44,107 @@ def test_database_events():
 
     assert "after_read_resource" in events
     assert "after_read_item" in events
+
+
+def test_late_event_registration():
+    with TestClient(app) as test_client:
+        assert not app.events.has_callbacks("before_DELETE", "people")
+
+        @app.on_event("before_DELETE_people")
+        def before_delete_callback(request):
+            events.append("before_DELETE")
+
+        assert app.events.has_callbacks("before_DELETE", "people")
+        response = test_client.post("/people", json={"name": "Franklin"})
+        test_client.delete(f"/people/{response.json()['_data'][0]['_id']}")
+
+    assert "before_DELETE" in events
+
+
+def test_concurrent_after_events():
+    import asyncio
+    from fasteve.events import Events
+
+    order = []
+
+    async def slow(name, *args):
+        await asyncio.sleep(0.01)
+        order.append("slow")
+
+    async def fast(name, *args):
+        order.append("fast")
+
+    concurrent = Events(resources, concurrent_after=True)
+    concurrent.after_read_resource += [slow, fast]
+    concurrent.compile()
+    asyncio.run(concurrent.run("after_read_resource", "people", {}))
+    assert order == ["fast", "slow"]
+
+    order.clear()
+    sequential = Events(resources)
+    sequential.after_read_resource += [slow, fast]
+    asyncio.run(sequential.run("after_read_resource", "people", {}))
+    assert order == ["slow", "fast"]
+
+
+def test_deferred_events():
+    import threading
+
+    threads = []
+
+    @app.on_event("after_read_resource_people", deferred=True)
+    def deferred_callback(response):
+        threads.append(threading.current_thread())
+
+    with TestClient(app) as test_client:
+        test_client.get("/people")
+        test_client.get("/people")
+    # drained on shutdown, in a worker thread
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
+    assert app.events.queue.stats()["completed"] >= 2
+    app.events.after_read_resource_people.remove(deferred_callback)
+
+    with pytest.raises(ValueError):
+        app.events.register("before_create_items", deferred_callback, deferred=True)
+
+
+def test_event_queue_overflow():
+    import asyncio
+    from fasteve.events import EventQueue
+
+    async def run():
+        queue = EventQueue(maxsize=1, workers=0, drain_timeout=0.01)
+        await queue.put(print, False, ())
+        await queue.put(print, False, ())
+        assert queue.stats()["queued"] == 1
+        assert queue.stats()["dropped"] == 1
+        await queue.stop()
+        assert queue.stats()["dropped"] == 2
+
+    asyncio.run(run())
+
+
+def test_deferred_per_registration():
+    from fasteve.events import Events
+
+    def callback(*args):
+        pass
+
+    events = Events(resources)
+    events.register("after_read_resource", callback, deferred=True)
+    events.register("after_read_item", callback)
+    events.compile()
+    deferred = {
+        event: events.table[(event, "people")][0][3]
+        for event in ("after_read_resource", "after_read_item")
+    }
+    assert deferred == {"after_read_resource": True, "after_read_item": False}
+
+    # removed like any other callback
+    events.after_read_resource.remove(callback)
+    events.register("after_read_resource", callback)
+    events.compile()
+    assert events.table[("after_read_resource", "people")] == (
+        (callback, False, True, False),
+    )
@@ -82,6 +82,7 @@ async def before_DELETE_people_callback(request: Request):
 @app.on_event("after_GET_people")
 async def after_GET_people_callback(request: Request, response):
     events.append("after_GET_people")
+    response.headers["x-resource"] = request.state.resource.name
 
 
 @app.on_event("after_POST_people")
@@ -129,3 +130,11 @@ def test_request_events():
     assert "after_GET" in events
     assert "after_POST" in events
     assert "after_DELETE" in events
+
+
+def test_after_event_response_headers():
+    with TestClient(app) as test_client:
+        response = test_client.get("/people")
+        assert response.headers["x-resource"] == "people"
+        response = test_client.get("/")
+        assert "x-resource" not in response.headers
@@ -1,8 +1,11 @@
-from typing import Optional
+from typing import Any, Dict, Optional, Union
 from pydantic import Field
-from fasteve import Fasteve, MongoModel, Resource, MongoObjectId
+from fasteve import Fasteve, Index, MongoModel, Resource, MongoObjectId
+from fasteve.core.utils import is_new_type
+from fasteve.io.indexes import IndexManager
 from starlette.testclient import TestClient
 
+import json
 import pytest
 
 
@@ -16,6 +19,8 @@ people = Resource(
     model=People,
     resource_methods=["GET", "POST", "DELETE"],
     item_methods=["GET", "DELETE", "PUT", "PATCH"],
+    export=True,
+    bulk_import=True,
 )
 
 resources = [people]
@@ -188,3 +193,355 @@ def test_patch_item(test_client, path, data, expected_status):
     item = response.json()["_data"][0]
     assert item["name"] == data["name"]
     assert item["_id"] == item_id
+
+
+@pytest.mark.parametrize(
+    "where,expected_names",
+    [
+        ('{"name": "Hypatia"}', ["Hypatia"]),
+        ('{"name": {"$in": ["Hypatia", "Noether"]}}', ["Hypatia", "Noether"]),
+        ('{"$or": [{"name": "Hypatia"}, {"name": "Noether"}]}', ["Hypatia", "Noether"]),
+        ('name == "Hypatia"', ["Hypatia"]),
+        ('name not in ["Hypatia", "Noether"]', ["Meitner"]),
+    ],
+)
+def test_get_where(test_client, where, expected_names):
+    test_client.delete("/people")
+    data = [{"name": "Hypatia"}, {"name": "Noether"}, {"name": "Meitner"}]
+    test_client.post("/people", json=data)  # insert data for test
+    response = test_client.get("/people", params={"where": where})
+    assert response.status_code == 200
+    assert [person["name"] for person in response.json()["_data"]] == expected_names
+    assert response.json()["_meta"]["total"] == len(expected_names)
+
+
+@pytest.mark.parametrize(
+    "where",
+    [
+        '{"$where": "1"}',
+        "name == {[1]: 2}",
+        pytest.param('{"$and": [' * 100000 + "{}" + "]}" * 100000, id="json-recursion"),
+    ],
+)
+def test_get_where_invalid(test_client, where):
+    response = test_client.get("/people", params={"where": where})
+    assert response.status_code == 422
+
+
+def test_get_where_object_id(test_client):
+    test_client.delete("/people")
+    response = test_client.post(
+        "/people", json=[{"name": "Curie"}, {"name": "Noether"}]
+    )
+    item_id = response.json()["_data"][1]["_id"]
+    # the string is coerced to an ObjectId to match the stored value
+    for where in (f'_id == "{item_id}"', json.dumps({"_id": {"$in": [item_id]}})):
+        response = test_client.get("/people", params={"where": where})
+        assert response.status_code == 200
+        assert [item["_id"] for item in response.json()["_data"]] == [item_id]
+
+
+def test_get_cursor_pagination(test_client, monkeypatch):
+    monkeypatch.setattr(people, "cursor_pagination", True)
+    test_client.delete("/people")
+    data = [{"name": name} for name in ("Curie", "Franklin", "Lovelace")]
+    test_client.post("/people", json=data)  # insert data for test
+    names = []
+    path = "/people?max_results=2"
+    while path:
+        response = test_client.get(path)
+        assert response.status_code == 200
+        body = response.json()
+        assert body["_meta"]["total"] == 3
+        names += [person["name"] for person in body["_data"]]
+        path = body["_links"]["next"]["href"] if "next" in body["_links"] else None
+    assert names == ["Curie", "Franklin", "Lovelace"]
+
+
+@pytest.mark.parametrize(
+    "method,data",
+    [("patch", {"name": "Lovelace"}), ("delete", None)],
+)
+def test_item_write_not_found(test_client, method, data):
+    kwargs = {"json": data} if data else {}
+    response = getattr(test_client, method)(f"/people/{MongoObjectId()}", **kwargs)
+    assert response.status_code == 404
+
+
+def test_bulk_insert_unordered_chunks(test_client, monkeypatch):
+    test_client.delete("/people")
+    monkeypatch.setattr(people, "bulk_ordered", False)
+    monkeypatch.setattr(people, "bulk_chunk_size", 2)
+
+    def duplicate_id(payload):
+        # the create model has no _id so add a duplicate before the insert
+        payload[2]["_id"] = payload[3]["_id"] = MongoObjectId()
+
+    monkeypatch.setattr(app.events, "before_create_items_people", [duplicate_id])
+    monkeypatch.setattr(app.events, "table", None)  # recompiled with the hook
+    data = [
+        {"name": "Curie"},
+        {"name": "Franklin"},
+        {"name": "Lovelace"},
+        {"name": "Hopper"},
+        {"name": "Noether"},
+    ]
+    response = test_client.post("/people", json=data)
+    assert response.status_code == 422
+    # an unordered insert keeps going past the duplicate
+    response = test_client.get("/people")
+    names = [person["name"] for person in response.json()["_data"]]
+    assert sorted(names) == ["Curie", "Franklin", "Lovelace", "Noether"]
+
+
+def test_indexes(test_client, monkeypatch):
+    test_client.portal.call(app.data.indexes.wait)
+    indexes = [Index(["name", ("_created", -1)], sparse=True)]
+    monkeypatch.setattr(people, "indexes", indexes)
+    report = test_client.portal.call(app.data.indexes.ensure, True)
+    assert report == {"people": ["name_1__created_-1"]}
+    test_client.portal.call(app.data.indexes.ensure)
+    report = test_client.portal.call(app.data.indexes.ensure, True)
+    assert report == {"people": []}
+    monkeypatch.undo()
+    app.data.indexes.refresh()  # computed once, not per query
+
+
+def test_indexes_typing_fields(monkeypatch):
+    class Setting(MongoModel):
+        id: Optional[MongoObjectId] = Field(alias="_id")
+        value: Union[int, str] = 0
+        extra: Any
+        labels: Dict[str, Any] = {}
+
+    settings = Resource(name="settings", model=Setting)
+    assert not is_new_type(Union[int, str])
+    assert not is_new_type(object())  # no __name__, like typing on python < 3.10
+    with TestClient(Fasteve(resources=[settings])) as client:
+        assert client.get("/settings").status_code == 200
+
+    def declared(self, resource):
+        raise AttributeError("__name__")
+
+    # a field that can't be inspected doesn't stop the app from starting
+    monkeypatch.setattr(IndexManager, "declared", declared)
+    with TestClient(Fasteve(resources=[settings])) as client:
+        assert client.get("/").status_code == 200
+
+
+@pytest.mark.parametrize(
+    "projection,expected_keys",
+    [('{"name": 1}', ["_id", "name"]), ('{"_id": 0}', ["name"])],
+)
+def test_get_projection(test_client, projection, expected_keys):
+    test_client.delete("/people")
+    test_client.post("/people", json=[{"name": "Curie"}, {"name": "Franklin"}])
+    response = test_client.get("/people", params={"projection": projection})
+    assert response.status_code == 200
+    assert sorted(response.json()["_data"][0]) == expected_keys
+
+
+def test_get_cursor_pagination_sort(test_client, monkeypatch):
+    test_client.delete("/people")
+    monkeypatch.setattr(people, "cursor_pagination", True)
+    data = [{"name": name} for name in ("Curie", "Lovelace", "Franklin")]
+    test_client.post("/people", json=data)  # insert data for test
+    names = []
+    path = "/people?sort=-name&max_results=2"
+    while path:
+        response = test_client.get(path)
+        assert response.status_code == 200
+        body = response.json()
+        names += [person["name"] for person in body["_data"]]
+        path = body["_links"]["next"]["href"] if "next" in body["_links"] else None
+    assert names == ["Lovelace", "Franklin", "Curie"]
+
+
+def test_get_page_links_keep_query(test_client, monkeypatch):
+    test_client.delete("/people")
+    monkeypatch.setattr(people, "count", "exact")
+    data = [{"name": name} for name in ("a", "b", "c", "d", "e", "f")]
+    test_client.post("/people", json=data)  # insert data for test
+    where = json.dumps({"name": {"$in": ["a", "b", "c"]}})
+    params = {"where": where, "sort": "-name", "max_results": 2}
+    response = test_client.get("/people", params=params)
+    body = response.json()
+    assert [person["name"] for person in body["_data"]] == ["c", "b"]
+    assert body["_meta"]["total"] == 3
+    response = test_client.get(body["_links"]["last"]["href"])
+    assert [person["name"] for person in response.json()["_data"]] == ["a"]
+    response = test_client.get(body["_links"]["next"]["href"])
+    body = response.json()
+    assert [person["name"] for person in body["_data"]] == ["a"]
+    assert body["_meta"] == {"max_results": 2, "page": 2, "total": 3}
+
+
+@pytest.mark.parametrize(
+    "settings,expected_status",
+    [
+        ({"allowed_filters": ["_id"]}, 422),
+        ({"index_policy": "reject"}, 422),
+        ({"index_policy": "reject", "slow_query_budget": 100}, 200),
+    ],
+)
+def test_get_where_allowed_filters(test_client, monkeypatch, settings, expected_status):
+    for name, value in settings.items():
+        monkeypatch.setattr(people, name, value)
+    response = test_client.get("/people", params={"where": '{"name": "Curie"}'})
+    assert response.status_code == expected_status
+
+
+def test_get_max_results_cap(test_client, monkeypatch):
+    test_client.delete("/people")
+    monkeypatch.setattr(people, "max_results_cap", 2)
+    data = [{"name": name} for name in ("Curie", "Franklin", "Lovelace")]
+    test_client.post("/people", json=data)  # insert data for test
+    response = test_client.get("/people", params={"max_results": 0})
+    assert response.json()["_meta"]["max_results"] == 1
+    response = test_client.get("/people", params={"max_results": 10})
+    assert response.json()["_meta"]["max_results"] == 2
+    assert len(response.json()["_data"]) == 2
+
+    async def stream():
+        return [person async for person in app.data.find_stream(people, batch_size=2)]
+
+    assert len(test_client.portal.call(stream)) == len(data)
+
+
+def test_export(test_client):
+    test_client.delete("/people")
+    data = [{"name": name} for name in ("Curie", "Franklin", "Lovelace")]
+    test_client.post("/people", json=data)  # insert data for test
+    response = test_client.get("/people/_export", params={"sort": "-name"})
+    assert response.status_code == 200
+    people = [json.loads(line) for line in response.text.splitlines()]
+    assert [person["name"] for person in people] == ["Lovelace", "Franklin", "Curie"]
+    assert all(MongoObjectId.is_valid(person["_id"]) for person in people)
+
+
+def test_import(test_client, monkeypatch):
+    test_client.delete("/people")
+    monkeypatch.setattr(app.config, "IMPORT_BATCH_SIZE", 2)
+    monkeypatch.setattr(people, "bulk_ordered", False)
+
+    def duplicate_id(payload):
+        if payload[0]["name"] == "Lovelace":
+            payload[0]["_id"] = payload[1]["_id"] = MongoObjectId()
+
+    monkeypatch.setattr(app.events, "before_create_items_people", [duplicate_id])
+    monkeypatch.setattr(app.events, "table", None)  # recompiled with the hook
+    names = ["Curie", "Franklin", "Lovelace", "Hopper", "Noether"]
+    body = "\n".join(json.dumps({"name": name}) for name in names) + "\n"
+    response = test_client.post("/people/_import", data=body.encode())
+    assert response.status_code == 200
+    report = response.json()
+    assert report["inserted"] == 4
+    assert [error["line"] for error in report["errors"]] == [4]
+
+
+def test_import_ordered_chunks(test_client, monkeypatch):
+    test_client.delete("/people")
+    monkeypatch.setattr(people, "bulk_ordered", True)
+    monkeypatch.setattr(people, "bulk_chunk_size", 2)
+
+    def duplicate_id(payload):
+        payload[2]["_id"] = payload[3]["_id"] = MongoObjectId()
+
+    monkeypatch.setattr(app.events, "before_create_items_people", [duplicate_id])
+    monkeypatch.setattr(app.events, "table", None)  # recompiled with the hook
+    names = ["Curie", "Franklin", "Lovelace", "Hopper", "Noether"]
+    body = "\n".join(json.dumps({"name": name}) for name in names) + "\n"
+    response = test_client.post("/people/_import", data=body.encode())
+    assert response.status_code == 200
+    report = response.json()
+    # the first chunk and Lovelace were stored before the duplicate
+    assert report["inserted"] == 3
+    assert report["errors"][0]["line"] == 4
+    assert len(test_client.get("/people").json()["_data"]) == 3
+
+
+@pytest.mark.parametrize(
+    "count,skip,limit,expected_names,expected_count",
+    [
+        ("exact", 0, 0, ["Curie", "Franklin", "Lovelace"], 3),
+        ("exact", 1, 1, ["Franklin"], 3),
+        ("cached", 0, 2, ["Curie", "Franklin"], 3),
+        ("none", 0, 2, ["Curie", "Franklin"], None),
+        ("exact", 5, 2, [], 3),
+    ],
+)
+def test_aggregate(
+    test_client, monkeypatch, count, skip, limit, expected_names, expected_count
+):
+    test_client.delete("/people")
+    data = [{"name": name} for name in ("Lovelace", "Curie", "Franklin", "Hopper")]
+    test_client.post("/people", json=data)  # insert data for test
+    monkeypatch.setattr(people, "count", count)
+    pipeline = [
+        {"$match": {"name": {"$ne": "Hopper"}}},
+        {"$addFields": {"initial": {"$substr": ["$name", 0, 1]}}},
+        {"$match": {"initial": {"$ne": "X"}}},
+        {"$sort": {"name": 1}},
+        {"$project": {"name": 1}},
+    ]
+    copy = json.loads(json.dumps(pipeline))
+    documents, total = test_client.portal.call(
+        app.data.aggregate, people, pipeline, skip, limit
+    )
+    assert [document["name"] for document in documents] == expected_names
+    assert total == expected_count
+    assert pipeline == copy  # not modified
+
+
+def test_aggregate_count_match_only(test_client, monkeypatch):
+    test_client.delete("/people")
+    test_client.post("/people", json=[{"name": "Curie"}, {"name": "Franklin"}])
+    queries = []
+    count = app.data.count
+
+    async def counted(resource, query, max_time_ms=None):
+        queries.append(query)
+        return await count(resource, query, max_time_ms)
+
+    monkeypatch.setattr(app.data, "count", counted)
+    pipeline = [{"$match": {"name": "Curie"}}, {"$sort": {"name": 1}}]
+    _, total = test_client.portal.call(app.data.aggregate, people, pipeline)
+    # counted with count_documents (and the resource count strategy)
+    assert total == 1
+    assert queries == [{"name": "Curie"}]
+
+
+def test_aggregate_stream(test_client):
+    test_client.delete("/people")
+    data = [{"name": name} for name in ("Curie", "Franklin", "Lovelace")]
+    test_client.post("/people", json=data)  # insert data for test
+
+    async def collect():
+        pipeline = [{"$sort": {"name": -1}}]
+        return [
+            document["name"]
+            async for document in app.data.aggregate_stream(people, pipeline, 2)
+        ]
+
+    assert test_client.portal.call(collect) == ["Lovelace", "Franklin", "Curie"]
+
+
+@pytest.mark.parametrize("sort", ["name", "-name"])
+def test_get_cursor_pagination_null_sort_keys(test_client, monkeypatch, sort):
+    monkeypatch.setattr(people, "cursor_pagination", True)
+    test_client.delete("/people")
+    data = [{"name": "Curie"}, {}, {"name": "Franklin"}, {}]
+    test_client.post("/people", json=data)  # insert data for test
+    names = []
+    params = {"sort": sort, "max_results": 1}
+    while True:
+        response = test_client.get("/people", params=params)
+        assert response.status_code == 200
+        names += [person.get("name") for person in response.json()["_data"]]
+        if "next" not in response.json()["_meta"]:
+            break
+        params["cursor"] = response.json()["_meta"]["next"]
+    if sort == "name":
+        assert names == [None, None, "Curie", "Franklin"]
+    else:
+        assert names == ["Franklin", "Curie", None, None]
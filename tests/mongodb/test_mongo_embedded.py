@@ -0,0 +1,94 @@
+from typing import List, Optional
+from pydantic import Field
+from fasteve import Fasteve, MongoModel, Resource, MongoObjectId
+from starlette.testclient import TestClient
+
+import json
+import pytest
+
+
+class Team(MongoModel):
+    id: Optional[MongoObjectId] = Field(alias="_id")
+    name: str
+
+
+teams = Resource(
+    name="teams",
+    model=Team,
+    resource_methods=["GET", "POST", "DELETE"],
+    item_methods=["GET"],
+)
+
+
+class Player(MongoModel):
+    id: Optional[MongoObjectId] = Field(alias="_id")
+    name: str
+    team: Optional[MongoObjectId] = Field(None, data_relation=teams)
+    rivals: Optional[List[MongoObjectId]] = Field(None, data_relation=teams)
+
+
+players = Resource(
+    name="players",
+    model=Player,
+    resource_methods=["GET", "POST", "DELETE"],
+    item_methods=["GET"],
+)
+
+app = Fasteve(resources=[teams, players])
+
+
+@pytest.fixture(scope="module")
+def test_client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.mark.parametrize(
+    "embedded,expected_team,expected_rivals",
+    [
+        ({"team": 1}, {"name": "Red"}, None),
+        ({"rivals": 1}, None, [{"name": "Red"}]),
+        ({"team": 1, "rivals": 1}, {"name": "Red"}, [{"name": "Red"}]),
+    ],
+)
+def test_get_embedded(
+    test_client, monkeypatch, embedded, expected_team, expected_rivals
+):
+    test_client.delete("/teams")
+    test_client.delete("/players")
+    response = test_client.post("/teams", json=[{"name": "Red"}, {"name": "Blue"}])
+    red, blue = [team["_id"] for team in response.json()["_data"]]
+    data = [
+        {"name": "Ada", "team": red, "rivals": [red, str(MongoObjectId())]},
+        {"name": "Bob", "team": red},
+        {"name": "Cy", "team": blue},
+    ]
+    test_client.post("/players", json=data)
+
+    fetched = []
+    find_list_of_ids = app.data.find_list_of_ids
+
+    async def counted(resource, ids, projection=None):
+        fetched.append(len(ids))
+        return await find_list_of_ids(resource, ids, projection)
+
+    monkeypatch.setattr(app.data, "find_list_of_ids", counted)
+    response = test_client.get(
+        "/players", params={"embedded": json.dumps(embedded), "sort": "name"}
+    )
+    assert response.status_code == 200
+    player = response.json()["_data"][0]
+    # one fetch per relation for the whole page
+    assert len(fetched) == len(embedded)
+    if expected_team:
+        assert player["team"]["name"] == expected_team["name"]
+        assert player["team"]["_id"] == red
+        assert response.json()["_data"][2]["team"]["name"] == "Blue"
+    else:
+        assert player["team"] == red
+    if expected_rivals:
+        # missing items are left out
+        assert [rival["name"] for rival in player["rivals"]] == ["Red"]
+    else:
+        assert len(player["rivals"]) == 2
+    assert response.json()["_meta"]["total"] == 3
@@ -0,0 +1,124 @@
+from typing import Optional
+from pydantic import Field
+from fasteve import Fasteve, MongoModel, Resource, MongoObjectId, SubResource
+from starlette.testclient import TestClient
+
+import pytest
+
+
+class Post(MongoModel):
+    id: Optional[MongoObjectId] = Field(alias="_id")
+    title: str
+    user_id: Optional[MongoObjectId]
+
+
+posts = Resource(
+    name="posts",
+    model=Post,
+    resource_methods=["GET", "POST", "DELETE"],
+    item_methods=["GET"],
+)
+
+
+class User(MongoModel):
+    id: Optional[MongoObjectId] = Field(alias="_id")
+    username: str
+
+
+users = Resource(
+    name="users",
+    model=User,
+    resource_methods=["GET", "POST", "DELETE"],
+    item_methods=["GET", "DELETE"],
+    alt_id="username",
+    sub_resources=[SubResource(resource=posts, id_field="user_id", name="posts")],
+)
+
+app = Fasteve(resources=[users, posts])
+
+
+@pytest.fixture(scope="module")
+def test_client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.mark.parametrize(
+    "user,expected_status,expected_titles",
+    [
+        ("alice", 200, ["a", "b"]),
+        ("bob", 200, ["c"]),
+        ("carol", 404, None),
+        ("id:alice", 200, ["a", "b"]),
+    ],
+)
+def test_get_sub_resource(test_client, user, expected_status, expected_titles):
+    test_client.delete("/users")
+    test_client.delete("/posts")
+    response = test_client.post(
+        "/users", json=[{"username": "alice"}, {"username": "bob"}]
+    )
+    ids = {item["username"]: item["_id"] for item in response.json()["_data"]}
+    data = [
+        {"title": "a", "user_id": ids["alice"]},
+        {"title": "b", "user_id": ids["alice"]},
+        {"title": "c", "user_id": ids["bob"]},
+    ]
+    test_client.post("/posts", json=data)
+    if user.startswith("id:"):
+        user = ids[user[3:]]
+    response = test_client.get(f"/users/{user}/posts")
+    assert response.status_code == expected_status
+    if expected_titles:
+        titles = [post["title"] for post in response.json()["_data"]]
+        assert titles == expected_titles
+
+
+def test_alt_id_cache(test_client):
+    test_client.delete("/users")
+    response = test_client.post("/users", json={"username": "alice"})
+    first_id = response.json()["_data"][0]["_id"]
+    assert test_client.get("/users/alice/posts").status_code == 200
+    assert str(app.data.alt_id_caches["users"].get("alice")) == first_id
+    # writes to the parent clear the cache
+    test_client.delete("/users")
+    assert app.data.alt_id_caches["users"].get("alice") is None
+    assert test_client.get("/users/alice/posts").status_code == 404
+
+
+def test_sub_resource_indexes(test_client):
+    assert [index.fields for index in app.data.indexes.declared(users)] == [
+        [("username", 1)]
+    ]
+    assert [index.fields for index in app.data.indexes.declared(posts)] == [
+        [("user_id", 1)]
+    ]
+
+
+def test_get_item_cache_alt_id(test_client, monkeypatch):
+    monkeypatch.setattr(users, "item_cache", 10)
+    test_client.delete("/users")
+    test_client.post("/users", json={"username": "alice"})
+    cache = app.data.get_item_cache(users)
+    hits = cache.stats()["hits"]
+    for _ in range(3):
+        response = test_client.get("/users/alice")
+        assert response.json()["_data"][0]["username"] == "alice"
+    assert cache.stats()["hits"] == hits + 2
+    test_client.delete("/users")
+    assert test_client.get("/users/alice").status_code == 404
+
+
+def test_alt_id_cache_write_race(test_client, monkeypatch):
+    test_client.delete("/users")
+    test_client.post("/users", json={"username": "alice"})
+    find_one = app.data.find_one
+
+    async def racing_find_one(resource, query, projection=None):
+        item = await find_one(resource, query, projection)
+        app.data.invalidate(resource)  # e.g. alice is deleted meanwhile
+        return item
+
+    monkeypatch.setattr(app.data, "find_one", racing_find_one)
+    assert test_client.get("/users/alice/posts").status_code == 200
+    assert app.data.alt_id_caches["users"].get("alice") is None
@@ -0,0 +1,71 @@
+from fasteve import Fasteve, MongoModel, Resource
+from starlette.testclient import TestClient
+
+import json
+import pytest
+
+
+class Note(MongoModel):
+    # no _id field, the primary key is still queryable
+    text: str
+
+
+notes = Resource(
+    name="notes",
+    model=Note,
+    resource_methods=["GET", "POST", "DELETE"],
+    item_methods=["GET"],
+    cursor_pagination=True,
+)
+
+app = Fasteve(resources=[notes])
+
+
+@pytest.fixture(scope="module")
+def test_client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture()
+def ids(test_client):
+    test_client.delete("/notes")
+    test_client.post("/notes", json=[{"text": t} for t in "abc"])
+    # _id is not in the response model
+    documents, _ = test_client.portal.call(app.data.find, notes)
+    return [str(document["_id"]) for document in documents]
+
+
+def test_get_cursor_pagination(test_client, ids):
+    response = test_client.get("/notes", params={"max_results": 2})
+    assert [note["text"] for note in response.json()["_data"]] == ["a", "b"]
+    cursor = response.json()["_meta"]["next"]
+    response = test_client.get("/notes", params={"max_results": 2, "cursor": cursor})
+    assert response.status_code == 200
+    assert [note["text"] for note in response.json()["_data"]] == ["c"]
+
+
+@pytest.mark.parametrize("syntax", ["json", "python"])
+def test_get_where_id(test_client, ids, syntax):
+    if syntax == "json":
+        where = json.dumps({"_id": ids[1]})
+    else:
+        where = f'_id == "{ids[1]}"'
+    response = test_client.get("/notes", params={"where": where})
+    assert response.status_code == 200
+    assert [note["text"] for note in response.json()["_data"]] == ["b"]
+
+
+@pytest.mark.parametrize(
+    "params,expected_status",
+    [
+        ({"sort": "-_id"}, 200),
+        ({"projection": '{"_id": 0}'}, 200),
+        ({"where": '{"_id": "not an id"}'}, 422),
+    ],
+)
+def test_get_id_params(test_client, ids, params, expected_status):
+    response = test_client.get("/notes", params=params)
+    assert response.status_code == expected_status
+    if "sort" in params:
+        assert [note["text"] for note in response.json()["_data"]] == ["c", "b", "a"]
@@ -0,0 +1,77 @@
+from typing import Optional
+from starlette.testclient import TestClient
+import pytest
+
+from fasteve import Fasteve, Resource, SQLModel, SQLDataLayer, SQLField
+
+
+class AsyncSQLDataLayer(SQLDataLayer):
+    mode = "async"
+
+
+class Hero(SQLModel, table=True):
+    id: Optional[int] = SQLField(primary_key=True)
+    name: str = SQLField()
+
+
+heroes = Resource(
+    name="heroes",
+    model=Hero,
+    resource_methods=["GET", "POST", "DELETE"],
+    item_methods=["GET", "DELETE", "PUT", "PATCH"],
+)
+
+resources = [heroes]
+
+app = Fasteve(resources=resources, data=AsyncSQLDataLayer)
+
+
+@pytest.fixture()
+def test_client():
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def test_async_engine():
+    assert app.data.mode == "async"
+    assert app.data.engine.url.drivername == "sqlite+aiosqlite"
+
+
+@pytest.mark.parametrize(
+    "path,data,expected_status",
+    [
+        (
+            "/heroes",
+            [{"name": "Marie Curie"}, {"name": "Ada Lovelace"}],
+            201,
+        ),
+    ],
+)
+def test_insert_and_get(test_client, path, data, expected_status):
+    response = test_client.post(path, json=data)
+    assert response.status_code == expected_status
+    itemid = response.json()["_data"][0]["id"]
+    response = test_client.get(path)
+    assert response.json()["_meta"]["total"] == len(data)
+    response = test_client.get(path + f"/{itemid}")
+    assert response.json()["_data"][0]["name"] == data[0]["name"]
+
+
+@pytest.mark.parametrize(
+    "path,data,expected_status",
+    [
+        ("/heroes", {"name": "Lovelace"}, 204),
+    ],
+)
+def test_patch_and_delete_item(test_client, path, data, expected_status):
+    response = test_client.post(path, json={"name": "Curie"})
+    itemid = response.json()["_data"][0]["id"]
+    response = test_client.patch(path + f"/{itemid}", json=data)
+    assert response.status_code == expected_status
+    response = test_client.get(path + f"/{itemid}")
+    assert response.json()["_data"][0]["name"] == data["name"]
+    response = test_client.delete(path + f"/{itemid}")
+    assert response.status_code == expected_status
+    response = test_client.get(path + f"/{itemid}")
+    assert response.status_code == 404
@@ -1,8 +1,9 @@
 from typing import Optional
 from starlette.testclient import TestClient
+import json
 import pytest
 
-from fasteve import Fasteve, Resource, SQLModel, SQLDataLayer, SQLField
+from fasteve import Fasteve, Index, Resource, SQLModel, SQLDataLayer, SQLField
 
 
 class People(SQLModel, table=True):
@@ -14,6 +15,8 @@ people = Resource(
     model=People,
     resource_methods=["GET", "POST", "DELETE"],
     item_methods=["GET", "DELETE", "PUT", "PATCH"],
+    export=True,
+    bulk_import=True,
 )
 
 resources = [people]
@@ -186,3 +189,453 @@ def test_patch_item(test_client, path, data, expected_status):
     item = response.json()["_data"][0]
     assert item["name"] == data["name"]
     assert item["id"] == itemid
+
+
+@pytest.mark.parametrize(
+    "where,expected_names",
+    [
+        ('{"name": "Curie"}', ["Curie"]),
+        ('{"name": {"$in": ["Curie", "Lovelace"]}}', ["Curie", "Lovelace"]),
+        ('{"id": {"$gt": 1, "$lte": 3}}', ["Franklin", "Lovelace"]),
+        ('{"$or": [{"name": "Curie"}, {"id": 3}]}', ["Curie", "Lovelace"]),
+        ('name == "Curie"', ["Curie"]),
+        ("1 < id <= 3", ["Franklin", "Lovelace"]),
+        ('name in ("Curie", "Franklin") and id != 1', ["Franklin"]),
+        ('id == "3" or "Curie" == name', ["Curie", "Lovelace"]),
+    ],
+)
+def test_get_where(test_client, where, expected_names):
+    data = [{"name": "Curie"}, {"name": "Franklin"}, {"name": "Lovelace"}]
+    test_client.post("/people", json=data)  # insert data for test
+    response = test_client.get("/people", params={"where": where})
+    assert response.status_code == 200
+    assert [person["name"] for person in response.json()["_data"]] == expected_names
+    assert response.json()["_meta"]["total"] == len(expected_names)
+
+
+@pytest.mark.parametrize(
+    "where",
+    [
+        "not json",
+        '{"name": {"$where": "1"}}',
+        '{"missing": 1}',
+        'missing == "Curie"',
+        'name == "Cu" + "rie"',
+        '__import__("os").system("true")',
+        "id == id",
+        'id == "one"',
+        "name == {[1]: 2}",
+        pytest.param('{"$and": [' * 100000 + "{}" + "]}" * 100000, id="json-recursion"),
+        pytest.param(
+            '{"$and": [' * 40 + '{"name": "Curie"}' + "]}" * 40, id="json-depth"
+        ),
+        pytest.param(
+            'name == "Curie" and (' * 40 + 'name == "Curie"' + ")" * 40,
+            id="python-depth",
+        ),
+    ],
+)
+def test_get_where_invalid(test_client, where):
+    response = test_client.get("/people", params={"where": where})
+    assert response.status_code == 422
+
+
+def test_get_cursor_pagination(test_client, monkeypatch):
+    monkeypatch.setattr(people, "cursor_pagination", True)
+    data = [{"name": name} for name in ("Curie", "Franklin", "Lovelace")]
+    test_client.post("/people", json=data)  # insert data for test
+    names = []
+    path = "/people?max_results=2"
+    while path:
+        response = test_client.get(path)
+        assert response.status_code == 200
+        body = response.json()
+        assert body["_meta"]["total"] == 3
+        assert "page" not in body["_meta"]
+        names += [person["name"] for person in body["_data"]]
+        path = body["_links"]["next"]["href"] if "next" in body["_links"] else None
+    assert names == ["Curie", "Franklin", "Lovelace"]
+
+
+def test_get_cursor_invalid(test_client, monkeypatch):
+    monkeypatch.setattr(people, "cursor_pagination", True)
+    response = test_client.get("/people", params={"cursor": "not a cursor"})
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize(
+    "count,expected_meta,expected_links",
+    [
+        (
+            "exact",
+            {"max_results": 2, "page": 1, "total": 3},
+            ["self", "parent", "next", "last"],
+        ),
+        (
+            "estimated",
+            {"max_results": 2, "page": 1, "total": 3},
+            ["self", "parent", "next"],
+        ),
+        (
+            "cached",
+            {"max_results": 2, "page": 1, "total": 3},
+            ["self", "parent", "next", "last"],
+        ),
+        (
+            "none",
+            {"max_results": 2, "page": 1, "has_more": True},
+            ["self", "parent", "next"],
+        ),
+    ],
+)
+def test_get_count(test_client, monkeypatch, count, expected_meta, expected_links):
+    monkeypatch.setattr(people, "count", count)
+    data = [{"name": name} for name in ("Curie", "Franklin", "Lovelace")]
+    test_client.post("/people", json=data)  # insert data for test
+    response = test_client.get("/people?max_results=2")
+    assert response.status_code == 200
+    assert len(response.json()["_data"]) == 2
+    assert response.json()["_meta"] == expected_meta
+    assert list(response.json()["_links"]) == expected_links
+
+
+def test_get_count_cached_invalidation(test_client, monkeypatch):
+    monkeypatch.setattr(people, "count", "cached")
+    test_client.post("/people", json={"name": "Curie"})
+    assert test_client.get("/people").json()["_meta"]["total"] == 1
+    test_client.post("/people", json={"name": "Franklin"})
+    assert test_client.get("/people").json()["_meta"]["total"] == 2
+
+
+def test_get_count_cached_write_race(test_client, monkeypatch):
+    monkeypatch.setattr(people, "count", "cached")
+    app.data.invalidate(people)
+    count_exact = app.data.count_exact
+    calls = []
+
+    async def racing_count_exact(resource, query, max_time_ms=None):
+        count = await count_exact(resource, query, max_time_ms)
+        if not calls:
+            app.data.invalidate(resource)  # a write finishes during the count
+        calls.append(count)
+        return count
+
+    monkeypatch.setattr(app.data, "count_exact", racing_count_exact)
+    test_client.get("/people")
+    test_client.get("/people")
+    test_client.get("/people")
+    # the count that raced the write was not cached, the next one was
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize(
+    "method,data",
+    [("patch", {"name": "Lovelace"}), ("delete", None)],
+)
+def test_item_write_not_found(test_client, method, data):
+    kwargs = {"json": data} if data else {}
+    response = getattr(test_client, method)("/people/404", **kwargs)
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        [{"name": name} for name in ("Curie", "Franklin", "Lovelace", "Noether")],
+        [{"id": 10 + i, "name": name} for i, name in enumerate(("Curie", "Franklin"))]
+        + [{"name": "Lovelace"}],
+    ],
+)
+def test_bulk_insert_chunked(test_client, monkeypatch, data):
+    monkeypatch.setattr(app.config, "SQL_BULK_CHUNK_SIZE", 2)
+    response = test_client.post("/people", json=data)
+    assert response.status_code == 201
+    documents = response.json()["_data"]
+    assert [person["name"] for person in documents] == [d["name"] for d in data]
+    assert len({person["id"] for person in documents}) == len(data)
+    response = test_client.get("/people")
+    assert response.json()["_meta"]["total"] == len(data)
+
+
+def test_indexes(test_client, monkeypatch):
+    test_client.portal.call(app.data.indexes.wait)
+    indexes = [Index([("name", -1)], partial={"name": {"$ne": ""}})]
+    monkeypatch.setattr(people, "indexes", indexes)
+    report = test_client.portal.call(app.data.indexes.ensure, True)
+    assert report == {"people": ["ix_people_name"]}
+    assert "ix_people_name" not in test_client.portal.call(
+        app.data.get_index_names, people
+    )
+    test_client.portal.call(app.data.indexes.ensure)
+    report = test_client.portal.call(app.data.indexes.ensure, True)
+    assert report == {"people": []}
+    monkeypatch.undo()
+    app.data.indexes.refresh()  # computed once, not per query
+
+
+def test_indexes_errors(test_client, monkeypatch):
+    test_client.portal.call(app.data.indexes.wait)
+    indexes = [Index(["name", "id"], unique=True), Index([("name", -1)])]
+    monkeypatch.setattr(people, "indexes", indexes)
+    create_index = app.data.create_index
+
+    async def failing_create_index(resource, index):
+        if index.unique:
+            raise ValueError("duplicate values")
+        await create_index(resource, index)
+
+    monkeypatch.setattr(app.data, "create_index", failing_create_index)
+    test_client.portal.call(app.data.indexes.ensure)
+    # one failing index doesn't stop the others
+    assert list(app.data.indexes.errors["people"]) == ["ix_people_name_id"]
+    report = test_client.portal.call(app.data.indexes.ensure, True)
+    assert report == {"people": ["ix_people_name_id"]}
+
+
+@pytest.mark.parametrize(
+    "projection,expected_item",
+    [
+        ('{"name": 1}', {"id": 1, "name": "Curie"}),
+        ('{"name": 1, "id": 0}', {"name": "Curie"}),
+        ('{"name": 0}', {"id": 1}),
+    ],
+)
+def test_get_projection(test_client, projection, expected_item):
+    test_client.post("/people", json=[{"name": "Curie"}, {"name": "Franklin"}])
+    response = test_client.get("/people", params={"projection": projection})
+    assert response.status_code == 200
+    assert response.json()["_data"][0] == expected_item
+    response = test_client.get("/people/1", params={"projection": projection})
+    assert response.status_code == 200
+    assert response.json()["_data"] == [expected_item]
+
+
+@pytest.mark.parametrize(
+    "projection",
+    ["not json", '{"name": 2}', '{"name": 1, "other": 0}', '{"missing": 1}'],
+)
+def test_get_projection_invalid(test_client, projection):
+    response = test_client.get("/people", params={"projection": projection})
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize(
+    "sort,expected_names",
+    [
+        ("name", ["Curie", "Franklin", "Lovelace"]),
+        ("-name", ["Lovelace", "Franklin", "Curie"]),
+        ("-id", ["Curie", "Franklin", "Lovelace"]),
+    ],
+)
+def test_get_sort(test_client, sort, expected_names):
+    data = [{"name": "Lovelace"}, {"name": "Franklin"}, {"name": "Curie"}]
+    test_client.post("/people", json=data)  # insert data for test
+    response = test_client.get("/people", params={"sort": sort})
+    assert response.status_code == 200
+    assert [person["name"] for person in response.json()["_data"]] == expected_names
+
+
+@pytest.mark.parametrize(
+    "index_policy,sort,expected_status",
+    [
+        ("reject", "name", 422),
+        ("reject", "-id", 200),
+        ("warn", "name", 200),
+        ("allow", "missing", 422),
+        ("allow", "name,-name", 422),
+    ],
+)
+def test_get_sort_index_policy(
+    test_client, monkeypatch, index_policy, sort, expected_status
+):
+    monkeypatch.setattr(people, "index_policy", index_policy)
+    response = test_client.get("/people", params={"sort": sort})
+    assert response.status_code == expected_status
+
+
+def test_get_cursor_pagination_sort(test_client, monkeypatch):
+    monkeypatch.setattr(people, "cursor_pagination", True)
+    data = [{"name": name} for name in ("Curie", "Lovelace", "Curie", "Franklin")]
+    test_client.post("/people", json=data)  # insert data for test
+    people_ = []
+    path = "/people?sort=-name&max_results=1"
+    while path:
+        response = test_client.get(path)
+        assert response.status_code == 200
+        body = response.json()
+        people_ += [(person["name"], person["id"]) for person in body["_data"]]
+        path = body["_links"]["next"]["href"] if "next" in body["_links"] else None
+    assert people_ == [("Lovelace", 2), ("Franklin", 4), ("Curie", 1), ("Curie", 3)]
+
+
+@pytest.mark.parametrize(
+    "settings,where,expected_status",
+    [
+        ({"allowed_filters": ["name"]}, '{"name": "Curie"}', 200),
+        ({"allowed_filters": ["name"]}, '{"$or": [{"name": "Curie"}, {"id": 1}]}', 422),
+        ({"allowed_filters": False}, '{"name": "Curie"}', 422),
+        ({"index_policy": "reject"}, '{"name": "Curie"}', 422),
+        ({"index_policy": "reject"}, '{"id": {"$gt": 1}}', 200),
+        ({"index_policy": "warn"}, '{"name": "Curie"}', 200),
+        (
+            {"index_policy": "reject", "slow_query_budget": 100},
+            '{"name": "Curie"}',
+            200,
+        ),
+    ],
+)
+def test_get_where_allowed_filters(
+    test_client, monkeypatch, settings, where, expected_status
+):
+    for name, value in settings.items():
+        monkeypatch.setattr(people, name, value)
+    response = test_client.get("/people", params={"where": where})
+    assert response.status_code == expected_status
+
+
+@pytest.mark.parametrize(
+    "max_results,cap,expected_max_results",
+    [(0, None, 1), (5, None, 5), (5000, None, 1000), (5, 2, 2), (-1, 2, 1)],
+)
+def test_get_max_results_cap(
+    test_client, monkeypatch, max_results, cap, expected_max_results
+):
+    monkeypatch.setattr(people, "max_results_cap", cap)
+    data = [{"name": name} for name in ("Curie", "Franklin", "Lovelace")]
+    test_client.post("/people", json=data)  # insert data for test
+    response = test_client.get("/people", params={"max_results": max_results})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["_meta"]["max_results"] == expected_max_results
+    assert len(body["_data"]) == min(expected_max_results, len(data))
+
+
+@pytest.mark.parametrize(
+    "sort,projection,expected_names",
+    [
+        (None, None, ["Curie", "Franklin", "Lovelace", "Curie", "Noether"]),
+        ([("name", -1)], {"name": 1}, ["Noether", "Lovelace", "Franklin"]),
+    ],
+)
+def test_find_stream(test_client, sort, projection, expected_names):
+    data = [
+        {"name": name} for name in ("Curie", "Franklin", "Lovelace", "Curie", "Noether")
+    ]
+    test_client.post("/people", json=data)  # insert data for test
+
+    async def stream():
+        stream = app.data.find_stream(
+            people, sort=sort, projection=projection, batch_size=2
+        )
+        return [person async for person in stream]
+
+    names = [person["name"] for person in test_client.portal.call(stream)]
+    assert names[: len(expected_names)] == expected_names
+    assert len(names) == len(data)
+
+
+@pytest.mark.parametrize(
+    "params,expected_names",
+    [
+        ({}, ["Curie", "Franklin", "Lovelace"]),
+        (
+            {"where": '{"name": {"$ne": "Franklin"}}', "sort": "-name"},
+            ["Lovelace", "Curie"],
+        ),
+    ],
+)
+def test_export(test_client, monkeypatch, params, expected_names):
+    monkeypatch.setattr(app.config, "EXPORT_BATCH_SIZE", 2)
+    data = [{"name": name} for name in ("Curie", "Franklin", "Lovelace")]
+    test_client.post("/people", json=data)  # insert data for test
+    response = test_client.get("/people/_export", params=params)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    people = [json.loads(line) for line in response.text.splitlines()]
+    assert [person["name"] for person in people] == expected_names
+
+
+def test_export_slow_query_budget(test_client, monkeypatch):
+    from fasteve.io.base import QueryTimeout
+
+    monkeypatch.setattr(people, "index_policy", "reject")
+    monkeypatch.setattr(people, "slow_query_budget", 100)
+    calls = []
+
+    async def find_stream(resource, **kwargs):
+        calls.append(kwargs["max_time_ms"])
+        raise QueryTimeout()
+        yield
+
+    monkeypatch.setattr(app.data, "find_stream", find_stream)
+    response = test_client.get("/people/_export", params={"where": '{"name": "a"}'})
+    # the unindexed filter runs within the budget
+    assert calls == [100]
+    assert response.status_code == 422
+
+
+def test_import(test_client, monkeypatch):
+    monkeypatch.setattr(app.config, "IMPORT_BATCH_SIZE", 2)
+    lines = [
+        '{"name": "Curie"}',
+        '{"name": "Franklin"}',
+        "not json",
+        "",
+        '{"name": "Lovelace"}',
+        '{"other": "Hopper"}',
+        "5",
+        "null",
+        '{"name": "Noether"}',
+    ]
+    response = test_client.post(
+        "/people/_import",
+        data="\n".join(lines).encode(),
+        headers={"content-type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    report = response.json()
+    assert report["inserted"] == 4
+    assert report["error_count"] == 4
+    assert [error["line"] for error in report["errors"]] == [3, 6, 7, 8]
+    response = test_client.get("/people")
+    assert [person["name"] for person in response.json()["_data"]] == [
+        "Curie",
+        "Franklin",
+        "Lovelace",
+        "Noether",
+    ]
+
+
+def test_get_item_cache(test_client, monkeypatch):
+    monkeypatch.setattr(people, "item_cache", 2)
+    monkeypatch.delitem(app.data.item_caches, people.name, raising=False)
+    response = test_client.post(
+        "/people", json=[{"name": "Curie"}, {"name": "Franklin"}, {"name": "Hopper"}]
+    )
+    ids = [item["id"] for item in response.json()["_data"]]
+    cache = app.data.get_item_cache(people)
+
+    for _ in range(2):
+        response = test_client.get(f"/people/{ids[0]}")
+        assert response.json()["_data"][0]["name"] == "Curie"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+    # writes clear the cache
+    test_client.patch(f"/people/{ids[0]}", json={"name": "Meitner"})
+    assert len(cache) == 0
+    response = test_client.get(f"/people/{ids[0]}")
+    assert response.json()["_data"][0]["name"] == "Meitner"
+
+    # least recently used items are evicted
+    test_client.get(f"/people/{ids[1]}")
+    test_client.get(f"/people/{ids[0]}")
+    test_client.get(f"/people/{ids[2]}")
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size"] == 2
+    hits = cache.stats()["hits"]
+    test_client.get(f"/people/{ids[0]}")
+    assert cache.stats()["hits"] == hits + 1
+
+    test_client.delete(f"/people/{ids[0]}")
+    assert test_client.get(f"/people/{ids[0]}").status_code == 404
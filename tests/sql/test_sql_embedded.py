@@ -0,0 +1,101 @@
+from typing import Optional
+from starlette.testclient import TestClient
+import json
+import pytest
+
+from fasteve import Fasteve, Resource, SQLModel, SQLDataLayer, SQLField
+
+
+class Guild(SQLModel, table=True):
+    id: Optional[int] = SQLField(primary_key=True)
+    name: str = SQLField()
+
+
+guilds = Resource(
+    model=Guild,
+    resource_methods=["GET", "POST"],
+    item_methods=["GET"],
+)
+
+
+class Knight(SQLModel, table=True):
+    id: Optional[int] = SQLField(primary_key=True)
+    name: str = SQLField()
+    guild: Optional[int] = SQLField(None, schema_extra={"data_relation": guilds})
+
+
+knights = Resource(
+    model=Knight,
+    resource_methods=["GET", "POST"],
+    item_methods=["GET"],
+)
+
+app = Fasteve(resources=[guilds, knights], data=SQLDataLayer)
+
+
+@pytest.fixture()
+def test_client():
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.mark.parametrize(
+    "embedded,expected_guilds",
+    [
+        (
+            {"guild": 1},
+            [{"id": 1, "name": "Templars"}, {"id": 2, "name": "Hospitallers"}],
+        ),
+        ({"guild": 0}, [1, 2]),
+        ({}, [1, 2]),
+    ],
+)
+def test_get_embedded(test_client, embedded, expected_guilds):
+    test_client.post("/guild", json=[{"name": "Templars"}, {"name": "Hospitallers"}])
+    test_client.post(
+        "/knight", json=[{"name": "Hugues", "guild": 1}, {"name": "Gerard", "guild": 2}]
+    )
+    response = test_client.get("/knight", params={"embedded": json.dumps(embedded)})
+    assert response.status_code == 200
+    assert [knight["guild"] for knight in response.json()["_data"]] == expected_guilds
+
+
+def test_get_embedded_invalid(test_client):
+    response = test_client.get("/knight", params={"embedded": '{"name": 1}'})
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize("direction", [1, -1])
+def test_keyset_null_sort_keys(test_client, monkeypatch, direction):
+    # guild is nullable, nulls sort first ascending and last descending
+    test_client.post(
+        "/knight",
+        json=[
+            {"name": "A", "guild": None},
+            {"name": "B", "guild": 2},
+            {"name": "C", "guild": None},
+            {"name": "D", "guild": 1},
+        ],
+    )
+    expected = ["A", "C", "D", "B"] if direction > 0 else ["B", "D", "A", "C"]
+
+    async def stream():
+        stream = app.data.find_stream(
+            knights, sort=[("guild", direction)], batch_size=1
+        )
+        return [knight["name"] async for knight in stream]
+
+    assert test_client.portal.call(stream) == expected
+
+    monkeypatch.setattr(knights, "cursor_pagination", True)
+    names = []
+    params = {"sort": "guild" if direction > 0 else "-guild", "max_results": 1}
+    while True:
+        response = test_client.get("/knight", params=params)
+        assert response.status_code == 200
+        names += [knight["name"] for knight in response.json()["_data"]]
+        if "next" not in response.json()["_meta"]:
+            break
+        params["cursor"] = response.json()["_meta"]["next"]
+    assert names == expected
@@ -0,0 +1,62 @@
+from typing import Optional
+from starlette.testclient import TestClient
+import pytest
+
+from fasteve import Fasteve, Resource, SQLModel, SQLDataLayer, SQLField
+
+
+class ThreadPoolSQLDataLayer(SQLDataLayer):
+    mode = "threadpool"
+
+
+class Villain(SQLModel, table=True):
+    id: Optional[int] = SQLField(primary_key=True)
+    name: str = SQLField()
+
+
+villains = Resource(
+    name="villains",
+    model=Villain,
+    resource_methods=["GET", "POST", "DELETE"],
+    item_methods=["GET", "DELETE", "PUT", "PATCH"],
+)
+
+resources = [villains]
+
+app = Fasteve(resources=resources, data=ThreadPoolSQLDataLayer)
+
+
+@pytest.fixture()
+def test_client():
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def test_threadpool_size():
+    # in memory sqlite is shared through a single connection
+    assert app.data.threadpool.size == 1
+
+
+@pytest.mark.parametrize(
+    "path,data,expected_status",
+    [
+        (
+            "/villains",
+            [{"name": "Moriarty"}, {"name": "Blofeld"}],
+            201,
+        ),
+    ],
+)
+def test_insert_and_get(test_client, path, data, expected_status):
+    test_client.portal.call(app.data.indexes.wait)  # runs in the pool too
+    completed = app.data.stats()["completed"]
+    response = test_client.post(path, json=data)
+    assert response.status_code == expected_status
+    itemid = response.json()["_data"][0]["id"]
+    response = test_client.get(path + f"/{itemid}")
+    assert response.json()["_data"][0]["name"] == data[0]["name"]
+    stats = app.data.stats()
+    assert stats["completed"] == completed + 2
+    assert stats["queued"] == 0
+    assert stats["active"] == 0